@@ -1,13 +1,12 @@
 #!/usr/bin/python3
 
 import agenda
-import subprocess
 import os
 import time
 import argparse
 import sys
 import toml
-from kv import connect_machines, intel_devbind, setup_all, dpdk_ld_var, local_path, check
+from kv import connect_machines, intel_devbind, setup_all, dpdk_ld_var, local_path, check, build_stamp
 
 def run_client(m, server_addr, num_msgs, arrival_pattern, cfg_client, outfile_pfx, bin_root_dir):
     agenda.subtask("running client")
@@ -159,7 +158,7 @@ def compile_binaries(conn, outdir, datapaths, dpdk_driver, target_dir):
 
         agenda.subtask(f"building switch-datapath features={needed_features}, target-dir {target_dir}")
         target_dir_arg = f"--target-dir {target_dir}/burrito-target" if target_dir is not None else ""
-        ok = conn.run(f"~/.cargo/bin/cargo build --examples --release --features=\"{','.join(needed_features)}\" {target_dir_arg}", wd = "~/burrito/dpdk-direct")
+        ok = conn.run_builds([f"cd dpdk-direct && ~/.cargo/bin/cargo build --examples --release --features=\"{','.join(needed_features)}\" {target_dir_arg}"], build_stamp(target_dir, "switch-datapath"))
         check(ok, "switch-datapath build", conn.addr)
     except Exception as e:
         agenda.failure(f"[{conn.addr}] compile_binaries failed: {e}")
@@ -211,7 +210,7 @@ def main(cfg):
             m.is_local = False
 
     if not found_local:
-        subprocess.run(f"mkdir -p {args.outdir}", shell=True)
+        os.makedirs(args.outdir, exist_ok=True)
 
     # fake this
     cfg['exp']['datapath'] = ['dpdkinline']
@@ -6,7 +6,7 @@ import threading
 import toml
 import os
 import agenda
-from kv import ConnectionWrapper
+from kv import ConnectionWrapper, in_parallel
 from localcn import LocalCn
 import time
 import itertools
@@ -424,8 +424,8 @@ def exp(cfg, outdir, overwrite=False, setup_only=False, debug=False):
     if setup_only:
         return
     # are there at least 5 lines in the out file?
-    # get file if necessary
-    for fl in fls:
+    # get file if necessary. the files come from different machines, so check them all at once.
+    def check_or_get(fl):
         while True:
             try:
                 with open(fl, 'r') as f:
@@ -455,6 +455,7 @@ def exp(cfg, outdir, overwrite=False, setup_only=False, debug=False):
                 c.get(root + fl.replace('.data', '.err'), local=err) #.err
             else:
                 raise Exception(f"Unknown file {fl}")
+    in_parallel(check_or_get, fls)
     agenda.task(f"exp done: {desc}")
 
 def connect(machine_cfg):
@@ -1,22 +1,20 @@
 #!/usr/bin/python3
 
+import itertools
 import os
 import toml
-import threading
 import argparse
 import sys
-import time
-import subprocess
 import agenda
-from kv import check_machine, setup_machine, start_redis, run_loads, run_client, get_local, dpdk_ld_var, setup_all, generate_ycsb_file, check, local_path, intel_devbind
+from kv import check_machine, setup_machine, start_redis, run_loads, start_client, reap_channels, finish_client, get_local, dpdk_ld_var, setup_all, ensure_ycsb_files, check, local_path, intel_devbind, in_parallel, parallel_run, workload_meta, make_outdirs, flush_redis, start_iokerneld, wait_proc, wait_serving, build_stamp, exp_dirs
 
 SRV_BASE_PORT = 4242
 
 def start_shard(conn, shard_ports, outf, datapath='kernel', skip_negotiation=False, bin_root="./target/release"):
-    conn.run("sudo pkill -9 single-shard")
-    conn.run("sudo pkill -9 iokerneld")
+    conn.kill_all([("single-shard", "9"), ("iokerneld", "9")])
+    wait_proc(conn, "single-shard", running=False)
     if datapath == 'shenango_channel':
-        conn.run(f"./iokerneld ias nicpci {conn.pci_addr}", wd="~/burrito/shenango-chunnel/caladan", sudo=True, background=True)
+        start_iokerneld(conn)
         datapath = 'shenango'
         cfg = '--cfg=shenango.config'
     elif datapath == 'kernel':
@@ -43,14 +41,14 @@ def start_shard(conn, shard_ports, outf, datapath='kernel', skip_negotiation=Fal
             )
     check(ok, "spawn shard", conn.addr)
     agenda.subtask("wait for single-shard check")
-    time.sleep(8)
-    conn.check_proc(f"single-shard", [f"{outf}.out", f"{outf}.err"])
+    conn.check_proc(f"single-shard", [f"burrito/{outf}.out", f"burrito/{outf}.err"], timeout=15)
+    wait_serving(conn, datapath, shard_ports, f"{outf}.out", "listening", count=len(shard_ports))
 
 def start_lb(conn, redis_addr, shard_addrs, threads, outf, datapath='kernel', skip_negotiation=False, bin_root="./target/release", use_opt=False):
-    conn.run("sudo pkill -9 burrito-lb")
-    conn.run("sudo pkill -9 iokerneld")
+    conn.kill_all([("burrito-lb", "9"), ("iokerneld", "9")])
+    wait_proc(conn, "burrito-lb", running=False)
     if datapath == 'shenango_channel':
-        conn.run(f"./iokerneld ias nicpci {conn.pci_addr}", wd="~/burrito/shenango-chunnel/caladan", sudo=True, background=True)
+        start_iokerneld(conn)
         datapath = 'shenango'
         cfg = '--cfg=shenango.config'
     elif datapath == 'kernel':
@@ -63,7 +61,6 @@ def start_lb(conn, redis_addr, shard_addrs, threads, outf, datapath='kernel', sk
     skip_neg = '--skip-negotiation' if skip_negotiation else ''
     opt_arg = '--opt' if use_opt else ''
 
-    time.sleep(2)
     ok = conn.run(f"RUST_LOG=info {dpdk_ld_var} {bin_root}/burrito-lb \
             --addr {conn.addr}:{SRV_BASE_PORT} \
             --redis-addr {redis_addr} \
@@ -82,105 +79,103 @@ def start_lb(conn, redis_addr, shard_addrs, threads, outf, datapath='kernel', sk
             )
     check(ok, "spawn burrito-lb", conn.addr)
     agenda.subtask("wait for burrito-lb check")
-    time.sleep(8)
-    conn.check_proc(f"burrito-lb", [f"{outf}.out", f"{outf}.err"])
+    conn.check_proc(f"burrito-lb", [f"burrito/{outf}.out", f"burrito/{outf}.err"], timeout=15)
+    # each lb thread logs this as it starts serving
+    wait_serving(conn, datapath, [SRV_BASE_PORT], f"{outf}.out", "starting serve_lb", count=threads)
 
 
-def do_exp(
+# parameters the lb and shard processes depend on. experiments that agree on these can share
+# one set of servers (and one round of loads); the others (load, poisson arrivals) only
+# change how the clients run.
+lb_server_params = ['datapath', 'skip_negotiation', 'use_opt', 'num_shards', 'wrkload']
+
+# common prefix of the lb's, shards', and loads client's output files for a server configuration
+def lb_server_prefix(outdir, iter_num, datapath=None, skip_negotiation=None, use_opt=None, num_shards=None, wrkload=None):
+    wrkname, _ = workload_meta(wrkload)
+    noneg = '_noneg' if skip_negotiation else ''
+    useopt = '_opt' if use_opt else ''
+    return f"{outdir}/{datapath}{noneg}{useopt}-{num_shards}-remoteshard-{wrkname}-{iter_num}"
+
+# (conn, outf) for the lb and for each shard; start_lb_server writes these and stop_lb_server
+# fetches them
+def lb_server_outfs(server_prefix, lb, shards):
+    return [(lb, f"{server_prefix}-lb")] + [(s, f"{server_prefix}-shard-{s.addr}") for s in shards]
+
+# common prefix of every client output file of the experiment with these parameters
+def lb_exp_prefix(outdir, iter_num, datapath=None, skip_negotiation=None, use_opt=None, num_shards=None, wrkload=None, ops_per_sec=None, poisson_arrivals=None):
+    wrkname, _ = workload_meta(wrkload)
+    noneg = '_noneg' if skip_negotiation else ''
+    useopt = '_opt' if use_opt else ''
+    return f"{outdir}/{datapath}{noneg}{useopt}-{num_shards}-remoteshard-load={ops_per_sec}-poisson={poisson_arrivals}-{wrkname}-{iter_num}"
+
+# the local file whose presence means the experiment with these parameters already ran
+def lb_exp_done_file(outdir, conns, iter_num, cloudlab=False, **params):
+    _, exp_outdir, _ = exp_dirs([conns['lb']], outdir, cloudlab)
+    check_file = f"{lb_exp_prefix(exp_outdir, iter_num, **params)}-client-{conns['clients'][0].addr}.data"
+    return local_path(check_file, outdir) if cloudlab else check_file
+
+def start_lb_server(
     iter_num=None,
     outdir=None,
     conns=None,
     num_shards=None,
-    ops_per_sec=None,
     datapath=None,
-    poisson_arrivals=None,
     wrkload=None,
-    overwrite=None,
     skip_negotiation=None,
+    use_opt=None,
     cfg_client={},
     cfg_server={},
-    use_opt=None,
     cloudlab=False,
+    redis_addr=None,
 ):
     assert(
         iter_num is not None and
         outdir is not None and
         conns is not None and
         num_shards is not None and
-        ops_per_sec is not None and
         datapath is not None and
-        poisson_arrivals is not None and
         wrkload is not None and
-        overwrite is not None and
         skip_negotiation is not None and
-        use_opt is not None
+        use_opt is not None and
+        redis_addr is not None
     )
-    wrkname = wrkload.split("/")[-1].split(".")[0]
-    noneg = '_noneg' if skip_negotiation else ''
-    useopt = '_opt' if use_opt else ''
-
-    target_dir = None
-    orig_outdir = outdir
-    if cloudlab:
-        res = conns[0].run("ls /proj/")
-        target_dir = f"/proj/{res.stdout.strip().split()[0]}"
-        outdir = f"{target_dir}/{outdir}"
-    agenda.subtask(f"exp outdir: {outdir} target dir: {target_dir}")
     lb = conns['lb']
     shards = conns['shards']
     clients = conns['clients']
-    exp_pfx = f"{outdir}/{datapath}{noneg}{useopt}-{num_shards}-remoteshard-load={ops_per_sec}-poisson={poisson_arrivals}-{wrkname}-{iter_num}"
-    server_prefix = f"{exp_pfx}-lb"
-    shard_prefix = f"{exp_pfx}-shard"
-    outf = f"{exp_pfx}-client"
-    check_file = f"{outf}-{clients[0].addr}.data"
-    check_file = local_path(check_file, orig_outdir) if cloudlab else check_file
-    agenda.task(f"checking {check_file}")
-    if not overwrite and os.path.exists(check_file):
-        agenda.task(f"skipping: load = {ops_per_sec} ops/s")
-        return True
-    else:
-        agenda.task(f"running: load = {ops_per_sec} ops/s")
 
-    for m in conns:
-        if m.is_local:
-            m.run(f"mkdir -p {outdir}", wd="~/burrito")
-            continue
-        m.run(f"rm -rf {outdir}", wd="~/burrito")
-        m.run(f"mkdir -p {outdir}", wd="~/burrito")
+    orig_outdir = outdir
+    target_dir, outdir, bin_root_dir = exp_dirs([lb], outdir, cloudlab)
+    agenda.subtask(f"exp outdir: {outdir} target dir: {target_dir}")
+    server_prefix = lb_server_prefix(outdir, iter_num, datapath=datapath, skip_negotiation=skip_negotiation, use_opt=use_opt, num_shards=num_shards, wrkload=wrkload)
+    outfs = lb_server_outfs(server_prefix, lb, shards)
+    [(_, lb_outf), *shard_outfs] = outfs
 
-    redis_addr = start_redis(lb)
-    time.sleep(5)
-    # load = (n (client threads / proc) * 1 (procs/machine) * {len(machines) - 1} (machines))
-    #        / {interarrival} (per client thread)
-    num_client_threads = int(wrkname.split('-')[-1])
-    interarrival_secs = num_client_threads * len(clients) / ops_per_sec
-    interarrival_us = int(interarrival_secs * 1e6)
-    agenda.task(f"starting: iter = {iter_num}, load = {ops_per_sec}, ops/s -> interarrival_us = {interarrival_us}, num_clients = {len(clients)}, num_shards = {num_shards}, skip_negotiation = {skip_negotiation}")
+    make_outdirs([lb] + shards + clients, outdir)
+
+    flush_redis(lb)
+    agenda.task(f"starting servers: iter = {iter_num}, datapath = {datapath}, num_shards = {num_shards}, skip_negotiation = {skip_negotiation}, use_opt = {use_opt}")
 
     shards_per_machine = int(num_shards / len(shards))
     if shards_per_machine > cfg_server['num-threads']:
         raise Exception(f"trying to start more shards per thread ({shards_per_machine}) than number of threads ({cfg_server['num_threads']})")
 
     threads = cfg_server['num-threads']
-    bin_root_dir = f"{target_dir}/burrito-target/release" if target_dir is not None else "./target/release"
 
     curr_shard_port = SRV_BASE_PORT + 1
     shard_addrs = []
     agenda.subtask("starting shards")
-    for s in shards:
+    for s, shard_outf in shard_outfs:
         shard_ports = list(range(curr_shard_port, curr_shard_port+shards_per_machine))
         curr_shard_port += shards_per_machine
         shard_addrs += [f"{s.addr}:{p}" for p in shard_ports]
         start_shard(
             s,
             shard_ports,
-            shard_prefix,
+            shard_outf,
             datapath=datapath,
             skip_negotiation=skip_negotiation,
             bin_root=bin_root_dir,
         )
-    time.sleep(5)
 
     agenda.subtask("starting lb")
     redis_port = redis_addr.split(":")[-1]
@@ -189,116 +184,149 @@ def do_exp(
         f"127.0.0.1:{redis_port}",
         " ".join(f"--shards {a}" for a in shard_addrs),
         threads,
-        server_prefix,
+        lb_outf,
         datapath=datapath,
         skip_negotiation=skip_negotiation,
         bin_root=bin_root_dir,
         use_opt=use_opt,
     )
-    time.sleep(5)
 
     # prime the server with loads
-    server_addr = lb.addr
-    # conn, server, redis_addr, outf, wrkload='uniform'
     agenda.task("doing loads")
     run_loads(
         clients[0],
         cfg_client,
-        server_addr,
+        lb.addr,
         datapath,
         redis_addr,
-        outf,
+        server_prefix,
         wrkload,
         skip_negotiation=num_shards if skip_negotiation else 0,
         bin_root=bin_root_dir
     )
 
-    get_fn = f"{'' if cloudlab else 'burrito/'}{outf}-loads"
-    loc = local_path(f"{outf}-loads", orig_outdir) if cloudlab else f"{outf}-loads"
+    get_fn = f"{'' if cloudlab else 'burrito/'}{server_prefix}-loads"
+    loc = local_path(f"{server_prefix}-loads", orig_outdir) if cloudlab else f"{server_prefix}-loads"
     try:
-        conns[1].get(get_fn+".out", local=loc+".out", preserve_mode=False)
-        conns[1].get(get_fn+".err", local=loc+".err", preserve_mode=False)
+        clients[0].get_many([get_fn+".out", get_fn+".err"], [loc+".out", loc+".err"])
     except Exception as e:
         agenda.subfailure(f"Could not get file {loc}.[out,err] from loads client: {e}")
 
-    time.sleep(2)
-    # others are clients
+    return outfs
+
+# started is what start_lb_server returned for this server configuration
+def stop_lb_server(
+    iter_num=None,
+    outdir=None,
+    conns=None,
+    cloudlab=False,
+    started=None,
+    **params,
+):
+    lb = conns['lb']
+    shards = conns['shards']
+    clients = conns['clients']
+
+    orig_outdir = outdir
+    _, outdir, _ = exp_dirs([lb], outdir, cloudlab)
+    server_prefix = lb_server_prefix(outdir, iter_num, **params)
+    outfs = lb_server_outfs(server_prefix, lb, shards)
+    if started is not None and [f for _, f in started] != [f for _, f in outfs]:
+        agenda.subfailure(f"start_lb_server wrote {[f for _, f in started]} but stop_lb_server expected {[f for _, f in outfs]}")
+        outfs = started
+
+    # kill the server
+    in_parallel(lambda m: m.kill_all([("burrito-lb", "9"), ("single-shard", "9"), ("iokerneld", "9")]), [lb] + shards)
+
+    parallel_run([lb] + shards + clients, "rm ~/burrito/*.config")
+
+    def get_server_files(m, outf):
+        if not m.is_local:
+            get_fn = f"{'' if cloudlab else 'burrito/'}{outf}"
+            loc = local_path(outf, orig_outdir) if cloudlab else outf
+            try:
+                m.get_many([get_fn +'.out', get_fn +'.err'], [loc +'.out', loc +'.err'])
+            except Exception as e:
+                agenda.subfailure(f"Could not get file {loc}.[out,err] from {m.addr}: {e}")
+
+    agenda.task("get lb and shard files")
+    in_parallel(lambda o: get_server_files(*o), outfs)
+
+# run one experiment's clients against the servers start_lb_server started
+def run_lb_clients(
+    iter_num=None,
+    outdir=None,
+    conns=None,
+    num_shards=None,
+    ops_per_sec=None,
+    datapath=None,
+    poisson_arrivals=None,
+    wrkload=None,
+    skip_negotiation=None,
+    use_opt=None,
+    cfg_client={},
+    cloudlab=False,
+    redis_addr=None,
+):
+    assert(
+        iter_num is not None and
+        outdir is not None and
+        conns is not None and
+        num_shards is not None and
+        ops_per_sec is not None and
+        datapath is not None and
+        poisson_arrivals is not None and
+        wrkload is not None and
+        skip_negotiation is not None and
+        use_opt is not None and
+        redis_addr is not None
+    )
+    _, num_client_threads = workload_meta(wrkload)
+    lb = conns['lb']
+    clients = conns['clients']
+
+    orig_outdir = outdir
+    _, outdir, bin_root_dir = exp_dirs([lb], outdir, cloudlab)
+    outf = f"{lb_exp_prefix(outdir, iter_num, datapath=datapath, skip_negotiation=skip_negotiation, use_opt=use_opt, num_shards=num_shards, wrkload=wrkload, ops_per_sec=ops_per_sec, poisson_arrivals=poisson_arrivals)}-client"
+
+    # load = (n (client threads / proc) * 1 (procs/machine) * {len(machines) - 1} (machines))
+    #        / {interarrival} (per client thread)
+    interarrival_secs = num_client_threads * len(clients) / ops_per_sec
+    interarrival_us = int(interarrival_secs * 1e6)
+    agenda.task(f"starting: iter = {iter_num}, load = {ops_per_sec}, ops/s -> interarrival_us = {interarrival_us}, num_clients = {len(clients)}, num_shards = {num_shards}, skip_negotiation = {skip_negotiation}")
+
+    server_addr = lb.addr
+    # others are clients. start them all, then wait for every ycsb from this thread; the
+    # first to fail stops the rest.
     agenda.task("starting clients")
-    client_threads = [threading.Thread(target=run_client, args=(
-            m,
-            cfg_client,
-            server_addr,
-            redis_addr,
-            interarrival_us,
-            poisson_arrivals,
-            datapath,
-            'remote',
-            num_shards if skip_negotiation else 0,
-            outf,
-            wrkload
-        ),
-        kwargs={'bin_root': bin_root_dir}
-    ) for m in clients]
-
-    [t.start() for t in client_threads]
-    [t.join() for t in client_threads]
+    def start(m):
+        try:
+            return start_client(m, cfg_client, server_addr, redis_addr, interarrival_us, poisson_arrivals, datapath, 'remote', num_shards if skip_negotiation else 0, outf, wrkload, bin_root=bin_root_dir)
+        except Exception as e:
+            agenda.subfailure(f"[{m.addr}] client did not start: {e}")
+            return None
+
+    started = [(m, s) for (m, s) in zip(clients, in_parallel(start, clients)) if s is not None]
+    results = reap_channels([s for (_, s) in started], fail_fast=True)
+    for ((m, _), res) in zip(started, results):
+        try:
+            finish_client(m, res)
+        except Exception as e:
+            agenda.subfailure(f"[{m.addr}] client failed: {e}")
     agenda.task("all clients returned")
 
-    # kill the server
-    lb.run("sudo pkill -9 burrito-lb")
-    lb.run("sudo pkill -9 iokerneld")
-    for s in shards:
-        s.run("sudo pkill -9 single-shard")
-        s.run("sudo pkill -9 iokerneld")
-
-    lb.run("rm ~/burrito/*.config")
-    for m in shards:
-        m.run("rm ~/burrito/*.config")
-    for m in clients:
-        m.run("rm ~/burrito/*.config")
-
-    agenda.task("get server files")
-    if not lb.is_local:
-        get_fn = f"{'' if cloudlab else 'burrito/'}{server_prefix}"
-        loc = local_path(f"{server_prefix}", orig_outdir) if cloudlab else f"{server_prefix}"
-        machines[0].get(get_fn +'.out', local=loc +'.out', preserve_mode=False)
-        machines[0].get(get_fn +'.err', local=loc +'.err', preserve_mode=False)
-    agenda.task("get shard files")
-    for s in shards:
-        if not s.local:
-            get_fn = f"{'' if cloudlab else 'burrito/'}{shard_prefix}-{s.addr}"
-            loc = local_path(f"{shard_prefix}-{s.addr}", orig_outdir) if cloudlab else f"{shard_prefix}-{s.addr}"
-            machines[0].get(get_fn +'.out', local=loc +'.out', preserve_mode=False)
-            machines[0].get(get_fn +'.err', local=loc +'.err', preserve_mode=False)
-            #s.get(f"burrito/{shard_prefix}-{s.addr}.trace", local=f"{shard_prefix}-{s.addr}.trace", preserve_mode=False)
-
-    def get_files(num):
-        fn = c.get
+    def get_files(c):
+        get_fn = f"{'' if cloudlab else 'burrito/'}{outf}-{c.addr}"
+        loc = local_path(f"{outf}-{c.addr}", orig_outdir) if cloudlab else f"{outf}-{c.addr}"
+        exts = ["err", "out", "data"]
+
         if c.is_local:
             agenda.subtask(f"Use get_local: {c.host}")
-            fn = get_local
-
-        get_fn = f"{'' if cloudlab else 'burrito/'}{outf}{num}"
-        loc = local_path(f"{outf}{num}-{c.addr}", orig_outdir) if cloudlab else f"{outf}{num}-{c.addr}"
-
-        agenda.subtask(f"getting {get_fn}.err")
-        fn(
-            f"{get_fn}.err",
-            local=f"{loc}.err",
-            preserve_mode=False,
-        )
-        agenda.subtask(f"getting {get_fn}.out")
-        fn(
-            f"{get_fn}.out",
-            local=f"{loc}.out",
-            preserve_mode=False,
-        )
-        agenda.subtask(f"getting {get_fn}.data")
-        fn(
-            f"{get_fn}.data",
-            local=f"{loc}.data",
-            preserve_mode=False,
-        )
+            for ext in exts:
+                agenda.subtask(f"getting {get_fn}.{ext}")
+                get_local(f"{get_fn}.{ext}", local=f"{loc}.{ext}", preserve_mode=False)
+        else:
+            c.get_many([f"{get_fn}.{ext}" for ext in exts], [f"{loc}.{ext}" for ext in exts])
         #agenda.subtask(f"getting {get_fn}.trace")
         #fn(
         #    f"{get_fn}.trace",
@@ -306,13 +334,15 @@ def do_exp(
         #    preserve_mode=False,
         #)
 
-    agenda.task("get client files")
-    for c in clients:
+    def get_client_files(c):
         try:
-            get_files(0)
+            get_files(c)
         except Exception as e:
             agenda.subfailure(f"At least one file missing for {c}: {e}")
 
+    agenda.task("get client files")
+    in_parallel(get_client_files, clients)
+
     agenda.task("done")
     return True
 
@@ -320,7 +350,7 @@ def connect_machines(cfg):
     agenda.task(f"Checking for connection vs experiment ip")
     ips = cfg['machines']['server'] + cfg['machines']['clients']
     agenda.task(f"connecting to {ips}")
-    machines, commits = zip(*[check_machine(ip) for ip in ips])
+    machines, commits = zip(*in_parallel(check_machine, ips))
     # check all the commits are equal
     if not all(c == commits[0] for c in commits):
         agenda.subfailure(f"not all commits equal: {commits}")
@@ -349,33 +379,30 @@ def compile_binaries_lb(conn, outdir, datapaths, dpdk_driver, target_dir):
                     needed_features.append('xl710_intel')
         agenda.subtask(f"building burrito-lb + single-shard features={needed_features}, target-dir {target_dir}")
         target_dir_arg = f"--target-dir {target_dir}/burrito-target" if target_dir is not None else ""
-        ok = conn.run(f"~/.cargo/bin/cargo build \
+        builds = [f"cd kvstore && ~/.cargo/bin/cargo build \
             --release \
             --features=\"{','.join(needed_features)}\" \
             --bin=\"single-shard\" \
             --bin=\"burrito-lb\" \
-            {target_dir_arg}",
-            wd = "~/burrito/kvstore")
-        check(ok, "kvserver build", conn.addr)
+            {target_dir_arg}"]
 
         agenda.subtask(f"building ycsb features={needed_features}")
-        ok = conn.run(f"~/.cargo/bin/cargo build \
+        builds.append(f"cd kvstore-ycsb && ~/.cargo/bin/cargo build \
             --release \
             --features=\"{','.join(needed_features[1:])}\" \
             --bin=\"ycsb\" \
-            {target_dir_arg}",
-            wd = "~/burrito/kvstore-ycsb")
-        check(ok, "ycsb build", conn.addr)
+            {target_dir_arg}")
 
         if 'dpdkmulti' in datapaths:
             needed_features = [f for f in needed_features if f == 'xl710_intel' or f == 'cx3_mlx' or f == 'cx4_mlx']
             agenda.subtask(f"building kv-dpdk features={needed_features} target-dir {target_dir}")
-            ok = conn.run(f"~/.cargo/bin/cargo build \
+            builds.append(f"cd kv-dpdk && ~/.cargo/bin/cargo build \
                 --release \
                 --features=\"{','.join(needed_features)}\" \
-                {target_dir_arg}",
-                wd = "~/burrito/kv-dpdk")
-            check(ok, "kv-dpdk build", conn.addr)
+                {target_dir_arg}")
+
+        ok = conn.run_builds(builds, build_stamp(target_dir, "kv-lb"))
+        check(ok, "build", conn.addr)
         return conn
     except Exception as e:
         agenda.failure(f"[{conn.addr}] setup_machine failed: {e}")
@@ -462,46 +489,52 @@ if __name__ == '__main__':
             m.is_local = False
 
     if not found_local:
-        subprocess.run(f"mkdir -p {args.outdir}", shell=True)
+        os.makedirs(args.outdir, exist_ok=True)
 
     # build
     setup_all(machines, cfg, args, setup_machine, compile_binaries_lb)
 
-    for w in cfg['exp']['wrk']:
-        for conn in machines:
-            ok = conn.run(f"ls {w}")
-            if ok.exited != 0:
-                generate_ycsb_file(conn, w)
+    in_parallel(lambda conn: ensure_ycsb_files(conn, cfg['exp']['wrk']), machines)
 
     if args.setup_only:
         agenda.task("setup done")
         sys.exit(0)
 
-    for iter_num in range(cfg['exp']['iters']):
-        for dp in cfg['exp']['datapath']:
-            if 'intel' == args.dpdk_driver:
-                intel_devbind(machines, dp)
-            for neg in cfg['exp']['negotiation']:
-                for w in cfg['exp']['wrk']:
-                    for s in cfg['exp']['shards']:
-                        for p in cfg['exp']['poisson-arrivals']:
-                            for o in cfg['exp']['load']:
-                                for z in cfg['exp']['optimization']:
-                                    do_exp(
-                                        iter_num=iter_num,
-                                        outdir=outdir,
-                                        conns=conns,
-                                        num_shards=s,
-                                        ops_per_sec=o,
-                                        datapath=dp,
-                                        poisson_arrivals=p,
-                                        wrkload=w,
-                                        skip_negotiation=not neg,
-                                        overwrite=args.overwrite,
-                                        cfg_client=cfg['cfg']['client'],
-                                        cfg_server=cfg['cfg']['server'],
-                                        cloudlab=args.cloudlab,
-                                        use_opt=z,
-                                    )
+    redis_addr = start_redis(conns['lb'])
+
+    axes = {
+        'iter_num': range(cfg['exp']['iters']),
+        'datapath': cfg['exp']['datapath'],
+        'skip_negotiation': [not neg for neg in cfg['exp']['negotiation']],
+        'use_opt': cfg['exp']['optimization'],
+        'num_shards': cfg['exp']['shards'],
+        'wrkload': cfg['exp']['wrk'],
+        'poisson_arrivals': cfg['exp']['poisson-arrivals'],
+        'ops_per_sec': cfg['exp']['load'],
+    }
+    srv_axes = ['iter_num'] + lb_server_params
+    assert set(list(axes)[:len(srv_axes)]) == set(srv_axes)
+    exps = [dict(zip(axes, combo)) for combo in itertools.product(*axes.values())]
+    num_exps = len(exps)
+    if not args.overwrite:
+        exps = [e for e in exps if not os.path.exists(lb_exp_done_file(outdir, conns, cloudlab=args.cloudlab, **e))]
+    agenda.task(f"{len(exps)} of {num_exps} experiments to run")
+
+    # start one set of servers per server configuration, and run each of its experiments'
+    # clients against it
+    exp_args = dict(outdir=outdir, conns=conns, cloudlab=args.cloudlab)
+    curr_dp = None
+    for srv_key, group in itertools.groupby(exps, key=lambda e: tuple(e[k] for k in srv_axes)):
+        srv = dict(zip(srv_axes, srv_key))
+        if srv['datapath'] != curr_dp and 'intel' == args.dpdk_driver:
+            intel_devbind(machines, srv['datapath'])
+        curr_dp = srv['datapath']
+
+        started = start_lb_server(cfg_client=cfg['cfg']['client'], cfg_server=cfg['cfg']['server'], redis_addr=redis_addr, **exp_args, **srv)
+        try:
+            for e in group:
+                run_lb_clients(cfg_client=cfg['cfg']['client'], redis_addr=redis_addr, **exp_args, **e)
+        finally:
+            stop_lb_server(started=started, **exp_args, **srv)
 
     agenda.task("done")
@@ -1,22 +1,20 @@
 #!/usr/bin/python3
 
-from kv import connect_machines, setup_all, get_local, check, get_timeout_local, write_cfg, write_shenango_config, local_path
+from kv import connect_machines, setup_all, get_local, check, get_timeout_local, write_cfg, write_shenango_config, local_path, in_parallel, workload_meta, make_outdirs, start_iokerneld, wait_proc, wait_serving, build_stamp
 import agenda
 import argparse
+import functools
 import os
 import shutil
-import subprocess
 import sys
 import threading
 import time
 import toml
 
 def start_server(conn, outf, shards=1, no_chunnels=False, bin_root="./target/release"):
-    conn.run("sudo pkill -INT kvserver")
-    conn.run("sudo pkill -INT iokerneld")
-
-    conn.run(f"./iokerneld ias nicpci {conn.pci_addr}", wd="~/burrito/shenango-chunnel/caladan", sudo=True, background=True)
-    time.sleep(2)
+    conn.kill_all([("kvserver", "INT")])
+    wait_proc(conn, "kvserver", running=False)
+    start_iokerneld(conn)
     nochunnels = ''
     if no_chunnels == 'conns' or no_chunnels==True:
         nochunnels = '-nochunnels'
@@ -24,7 +22,7 @@ def start_server(conn, outf, shards=1, no_chunnels=False, bin_root="./target/rel
     #cns = '--use-connections' if len(nochunnels) >0 else ''
     cns = ''
 
-    ok = conn.run(f"{bin_root}/kvserver-shenango-raw{nochunnels} --addr {conn.addr}:4242 --num-shards {shards} {cns} --cfg shenango.config",
+    ok = conn.run(f"RUST_LOG=info {bin_root}/kvserver-shenango-raw{nochunnels} --addr {conn.addr}:4242 --num-shards {shards} {cns} --cfg shenango.config --log",
             wd="~/burrito",
             sudo=True,
             background=True,
@@ -33,15 +31,16 @@ def start_server(conn, outf, shards=1, no_chunnels=False, bin_root="./target/rel
             )
     check(ok, "spawn server", conn.addr)
     agenda.subtask("wait for kvserver check")
-    time.sleep(8)
-    conn.check_proc(f"kvserver", [f"{outf}.err"])
+    conn.check_proc(f"kvserver", [f"burrito/{outf}.err"], timeout=15)
+    # loads are not retried, so don't start them until every shard (and, with chunnels, the
+    # canonical server) is up
+    wait_serving(conn, 'shenango', [], f"{outf}.out", "listening", count=shards)
+    if not nochunnels:
+        wait_serving(conn, 'shenango', [], f"{outf}.out", "start canonical server")
 
 def run_client(conn, server, interarrival, poisson_arrivals, no_chunnels, outf, wrkfile, bin_root="./target/release"):
-    conn.run("sudo pkill -INT iokerneld")
-
     timeout = get_timeout_local(wrkfile, interarrival)
-    conn.run(f"./iokerneld ias nicpci {conn.pci_addr}", wd="~/burrito/shenango-chunnel/caladan", sudo=True, background=True)
-    time.sleep(2)
+    start_iokerneld(conn)
     poisson_arg = "--poisson-arrivals" if poisson_arrivals  else ''
     outf = f"{outf}-{conn.addr}"
 
@@ -64,16 +63,14 @@ def run_client(conn, server, interarrival, poisson_arrivals, no_chunnels, outf,
         stdout=f"{outf}.out",
         stderr=f"{outf}.err",
         timeout=timeout,
+        pty=True,
         )
     check(ok, "client", conn.addr)
-    conn.run("sudo pkill -INT iokerneld")
+    conn.kill_all([("iokerneld", "INT")])
     agenda.subtask("client done")
 
 def run_loads(conn, server, outf, wrkfile, no_chunnels=False, bin_root="./target/release"):
-    conn.run("sudo pkill -INT iokerneld")
-
-    conn.run(f"./iokerneld ias nicpci {conn.pci_addr}", wd="~/burrito/shenango-chunnel/caladan", sudo=True, background=True)
-    time.sleep(2)
+    start_iokerneld(conn)
     nochunnels = ''
     shards_arg = ''
     if no_chunnels:
@@ -95,13 +92,14 @@ def run_loads(conn, server, outf, wrkfile, no_chunnels=False, bin_root="./target
             stdout=f"{outf}-loads.out",
             stderr=f"{outf}-loads.err",
             timeout=30,
+            pty=True,
             )
         print(ok)
     except Exception as e:
         print(e)
         agenda.subfailure(f"loads failed") #, retrying after {time.time() - loads_start} s")
     finally:
-        conn.run("sudo pkill -INT iokerneld")
+        conn.kill_all([("iokerneld", "INT")])
     if ok is None or ok.exited != 0:
         agenda.subfailure(f"loads failed, retrying after {time.time() - loads_start} s")
         sys.exit(1)
@@ -137,7 +135,7 @@ def do_exp(iter_num,
         target_dir = f"/proj/{res.stdout.strip().split()[0]}"
         outdir = f"{target_dir}/{outdir}"
 
-    wrkname = wrkload.split("/")[-1].split(".")[0]
+    wrkname, num_client_threads = workload_meta(wrkload)
     if no_chunnels == True or no_chunnels == 'off' or no_chunnels == 'conns':
         noch = '_nochunnels'
     else:
@@ -146,26 +144,22 @@ def do_exp(iter_num,
     server_prefix = f"{outdir}/shenangort{noch}-{num_shards}-clientshard-{ops_per_sec}-poisson={poisson_arrivals}-{wrkname}-{iter_num}-kvserver"
     outf = f"{outdir}/shenangort{noch}-{num_shards}-clientshard-{ops_per_sec}-poisson={poisson_arrivals}-{wrkname}-{iter_num}-client"
 
-    for m in machines:
-        if m.local:
-            m.run(f"mkdir -p {outdir}", wd="~/burrito")
-            continue
-        m.run(f"rm -rf {outdir}", wd="~/burrito")
-        m.run(f"mkdir -p {outdir}", wd="~/burrito")
+    make_outdirs(machines, outdir)
 
-    if not overwrite and os.path.exists(f"{outf}0-{machines[1].addr}.data"):
+    # run_client writes {outf}-{addr}.data, and get_files fetches it to the same name locally
+    done_file = f"{outf}-{machines[1].addr}.data"
+    done_file = local_path(done_file, orig_outdir) if cloudlab else done_file
+    if not overwrite and os.path.exists(done_file):
         agenda.task(f"skipping: server = {machines[0].addr}, num_shards = {num_shards}, no_chunnels = {no_chunnels} load = {ops_per_sec} ops/s")
         return True
     else:
-        agenda.task(f"running: {outf}0-{machines[1].addr}.data")
+        agenda.task(f"running: {done_file}")
 
     # load = (n (client threads / proc) * 1 (procs/machine) * {len(machines) - 1} (machines))
     #        / {interarrival} (per client thread)
-    num_client_threads = int(wrkname.split('-')[-1])
     interarrival_secs = num_client_threads * len(machines[1:]) / ops_per_sec
     interarrival_us = int(interarrival_secs * 1e6)
 
-    time.sleep(5)
     server_addr = machines[0].addr
     agenda.task(f"starting: server = {machines[0].addr}, num_shards = {num_shards}, no_chunnels = {no_chunnels}, load = {ops_per_sec} ops/s -> interarrival_us = {interarrival_us}, num_clients = {len(machines)-1}")
 
@@ -174,7 +168,6 @@ def do_exp(iter_num,
     # first one is the server, start the server
     agenda.subtask("starting server")
     start_server(machines[0], server_prefix, shards=num_shards, no_chunnels=no_chunnels, bin_root=bin_root_dir)
-    time.sleep(5)
     # prime the server with loads
     agenda.task("doing loads")
     run_loads(machines[1], server_addr, outf, wrkload, no_chunnels=num_shards if no_chunnels else 0, bin_root=bin_root_dir)
@@ -182,8 +175,7 @@ def do_exp(iter_num,
     get_fn = f"{'' if cloudlab else 'burrito/'}{outf}-loads"
     loc = local_path(f"{outf}-loads", orig_outdir) if cloudlab else f"{outf}-loads"
     try:
-        machines[1].get(get_fn+".out", local=loc+".out", preserve_mode=False)
-        machines[1].get(get_fn+".err", local=loc+".err", preserve_mode=False)
+        machines[1].get_many([get_fn+".out", get_fn+".err"], [loc+".out", loc+".err"])
     except Exception as e:
         agenda.subfailure(f"Could not get file {loc}.[out,err] from loads client: {e}")
 
@@ -206,57 +198,37 @@ def do_exp(iter_num,
     agenda.task("all clients returned")
 
     # kill the server
-    machines[0].run("sudo pkill -INT kvserver")
-    machines[0].run("sudo pkill -INT iokerneld")
+    machines[0].kill_all([("kvserver", "INT"), ("iokerneld", "INT")])
 
-    agenda.task("get server files")
-    if not machines[0].is_local:
-        get_fn = f"{'' if cloudlab else 'burrito/'}{server_prefix}"
-        loc = local_path(f"{server_prefix}", orig_outdir) if cloudlab else f"{server_prefix}"
-        machines[0].get(get_fn +'.out', local=loc +'.out', preserve_mode=False)
-        machines[0].get(get_fn +'.err', local=loc +'.err', preserve_mode=False)
+    def get_server_files():
+        if not machines[0].is_local:
+            get_fn = f"{'' if cloudlab else 'burrito/'}{server_prefix}"
+            loc = local_path(f"{server_prefix}", orig_outdir) if cloudlab else f"{server_prefix}"
+            machines[0].get_many([get_fn +'.out', get_fn +'.err'], [loc +'.out', loc +'.err'])
 
     def get_files(c):
-        fn = c.get
-        if c.is_local:
-            agenda.subtask(f"Use get_local: {c.host}")
-            fn = get_local
-
         get_fn = f"{'' if cloudlab else 'burrito/'}{outf}-{c.addr}"
         loc = local_path(f"{outf}-{c.addr}", orig_outdir) if cloudlab else f"{outf}-{c.addr}"
+        exts = ["err", "out", "data", "trace"]
 
-        agenda.subtask(f"getting {get_fn}.err")
-        fn(
-            f"{get_fn}.err",
-            local=f"{loc}.err",
-            preserve_mode=False,
-        )
-        agenda.subtask(f"getting {get_fn}.out")
-        fn(
-            f"{get_fn}.out",
-            local=f"{loc}.out",
-            preserve_mode=False,
-        )
-        agenda.subtask(f"getting {get_fn}.data")
-        fn(
-            f"{get_fn}.data",
-            local=f"{loc}.data",
-            preserve_mode=False,
-        )
-        agenda.subtask(f"getting {get_fn}.trace")
-        fn(
-            f"{get_fn}.trace",
-            local=f"{loc}.trace",
-            preserve_mode=False,
-        )
+        if c.is_local:
+            agenda.subtask(f"Use get_local: {c.host}")
+            for ext in exts:
+                agenda.subtask(f"getting {get_fn}.{ext}")
+                get_local(f"{get_fn}.{ext}", local=f"{loc}.{ext}", preserve_mode=False)
+        else:
+            c.get_many([f"{get_fn}.{ext}" for ext in exts], [f"{loc}.{ext}" for ext in exts])
 
-    agenda.task("get client files")
-    for c in machines[1:]:
+    def get_client_files(c):
         try:
             get_files(c)
         except Exception as e:
             agenda.subfailure(f"At least one file missing for {c}: {e}")
 
+    # the server's and every client's files at once
+    agenda.task("get server and client files")
+    in_parallel(lambda get: get(), [get_server_files] + [functools.partial(get_client_files, c) for c in machines[1:]])
+
     agenda.task("done")
     return True
 
@@ -264,12 +236,9 @@ def setup_machine(conn, outdir, datapaths, dpdk_driver, target_dir):
     agenda.task(f"[{conn.addr}] setup machine")
     try:
         agenda.subtask(f"[{conn.addr}] make outdir {outdir}")
-        ok = conn.run(f"mkdir -p {target_dir if target_dir is not None else '~/burrito'}/{outdir}")
-        check(ok, "mk outdir", conn.addr)
-
         # dpdk dependencies, rust, and docker
-        ok = conn.run("bash scripts/install-kv-deps.sh", wd="~/burrito")
-        check(ok, "install dependencies", conn.addr)
+        ok = conn.run(f"set -e; mkdir -p {target_dir if target_dir is not None else '~/burrito'}/{outdir}; bash scripts/install-kv-deps.sh", wd="~/burrito")
+        check(ok, "mk outdir + install dependencies", conn.addr)
 
         # caladan/build/config:
         # CONFIG_MLX5=y/n, CONFIG_MLX4=y/n
@@ -284,11 +253,8 @@ def setup_machine(conn, outdir, datapaths, dpdk_driver, target_dir):
 
         agenda.subtask(f"[{conn.addr}] building shenango")
         # need to compile iokerneld
-        ok = conn.run("make", wd = "~/burrito/shenango-chunnel/caladan")
-        check(ok, "build shenango", conn.addr)
-
-        ok = conn.run("./scripts/setup_machine.sh", wd = "~/burrito/shenango-chunnel/caladan")
-        check(ok, "shenango setup-machine", conn.addr)
+        ok = conn.run("set -e; make; ./scripts/setup_machine.sh", wd = "~/burrito/shenango-chunnel/caladan")
+        check(ok, "build shenango + shenango setup-machine", conn.addr)
     except Exception as e:
         agenda.failure(f"[{conn.addr}] setup_machine failed: {e}")
         global thread_ok
@@ -299,7 +265,7 @@ def compile_binaries(conn, outdir, datapaths, dpdk_driver, target_dir):
     try:
         target_dir_arg = f"--target-dir {target_dir}/burrito-target" if target_dir is not None else ""
         agenda.subtask(f"building kvserver-shenango")
-        ok = conn.run(f"~/.cargo/bin/cargo +nightly build --release {target_dir_arg}", wd = "~/burrito/shenango-bertha")
+        ok = conn.run_builds([f"cd shenango-bertha && ~/.cargo/bin/cargo +nightly build --release {target_dir_arg}"], build_stamp(target_dir, "kv-shenango"))
         check(ok, "shenango-bertha build", conn.addr)
 
         return conn
@@ -381,7 +347,7 @@ if __name__ == '__main__':
             m.is_local = False
 
     if not found_local:
-        subprocess.run(f"mkdir -p {args.outdir}", shell=True)
+        os.makedirs(args.outdir, exist_ok=True)
 
     # build
     cfg['exp']['datapath'] = ['shenangort']
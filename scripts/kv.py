@@ -1,12 +1,24 @@
 #!/usr/bin/python3
 
+from concurrent.futures import ThreadPoolExecutor
 from fabric import Connection
+from fabric.runners import Result
+from invoke.exceptions import CommandTimedOut
 import agenda
 import argparse
+import collections
+import functools
+import hashlib
+import io
+import itertools
 import os
+import pathlib
+import selectors
+import shlex
 import shutil
-import subprocess
+import socket
 import sys
+import tarfile
 import threading
 import time
 import toml
@@ -14,6 +26,93 @@ import toml
 global thread_ok
 thread_ok = True
 
+# ssh clients keyed by (user, host, port), shared by every ConnectionWrapper to that host.
+# fabric runs each command/transfer as a new channel on the client's transport, so
+# sharing the client means the tcp + key exchange + auth handshake happens once per host.
+ssh_clients = {}
+ssh_clients_lock = threading.Lock()
+
+# sftp sessions on the pooled clients, keyed the same way, so every put/get to a host
+# reuses one session instead of each wrapper paying the sftp subsystem startup.
+# an sftp client is not safe to use from several threads at once, so transfers on each
+# session are serialized by its lock in sftp_locks.
+sftp_clients = {}
+sftp_locks = {}
+
+# seconds between ssh keepalives on the shared transports, so the one connection per host
+# survives long idle stretches (builds, long experiments) instead of being dropped by a
+# middlebox and re-handshaked
+ssh_keepalive_secs = 30
+
+# marks the end of each command's output in run_batch
+BATCH_SEP = "__TBM_SEP__"
+
+# a command started by ConnectionWrapper.start_channel, to be collected with reap_channels
+StartedCmd = collections.namedtuple('StartedCmd', ['conn', 'chan', 'command', 'timeout', 'deadline'])
+
+# reap_channels' result for a command it stopped because another one failed first
+class CommandCancelled(Exception):
+    def __init__(self, result):
+        self.result = result
+        super().__init__(f"command on {result.connection.addr} stopped early after another one failed: {result.command}")
+
+# shlex.quote, but leave a leading ~/ unquoted so the remote shell still expands it
+def quote_path(path):
+    if path == "~" or path == "~/":
+        return path
+    if path.startswith("~/"):
+        return "~/" + shlex.quote(path[2:])
+    return shlex.quote(path)
+
+# dependent commands as one shell script: each runs in its own subshell, and the first to
+# fail stops the script with its exit code and says which step it was on stderr
+def seq_script(cmds):
+    return "; ".join(
+        f"( {c} ) || {{ r=$?; echo \"step {i} failed ($r): \"{shlex.quote(c)} >&2; exit $r; }}"
+        for (i, c) in enumerate(cmds)
+    )
+
+# the part of a ConnectionWrapper command before `bash -c`. experiments reuse a handful of
+# (wd, sudo, background) combinations, so build each once.
+@functools.lru_cache(maxsize=None)
+def cmd_prefix(wd, sudo, background):
+    pre = ""
+    if wd:
+        pre += f"cd {quote_path(wd)} && "
+    if background:
+        pre += "screen -d -m "
+    if sudo:
+        pre += "sudo "
+    return pre
+
+# results of ConnectionWrapper probes (file_exists, prog_exists, local_path), keyed by
+# (user, host, port, probe, args) so every wrapper for a host shares them.
+# values are (expiry time, result).
+probe_cache = {}
+probe_cache_lock = threading.Lock()
+probe_cache_ttl_secs = 300
+
+# commit of ~/burrito on each machine check_machine has checked, keyed by (user, host, port)
+machine_commits = {}
+
+# memoize a ConnectionWrapper probe, keeping only positive answers: files and programs
+# appearing mid-run is expected, but nothing here removes them. entries expire after
+# probe_cache_ttl_secs so long runs still notice if something does change.
+def cache_probe(fn):
+    @functools.wraps(fn)
+    def wrapper(self, *args, **kwargs):
+        key = (self.user, self.host, self.port, fn.__name__, args)
+        with probe_cache_lock:
+            hit = probe_cache.get(key)
+        if hit is not None and hit[0] > time.time():
+            return hit[1]
+        res = fn(self, *args, **kwargs)
+        if res:
+            with probe_cache_lock:
+                probe_cache[key] = (time.time() + probe_cache_ttl_secs, res)
+        return res
+    return wrapper
+
 class ConnectionWrapper(Connection):
     def __init__(self, addr, user=None, port=None):
         super().__init__(
@@ -25,8 +124,45 @@ class ConnectionWrapper(Connection):
         self.addr = addr
         self.conn_addr = addr
 
-        # Start the ssh connection
+        key = (self.user, self.host, self.port)
+        with ssh_clients_lock:
+            client = ssh_clients.get(key)
+        if client is not None and client.get_transport() is not None and client.get_transport().is_active():
+            self.client = client
+            self.transport = client.get_transport()
+        else:
+            # Start the ssh connection
+            self.open()
+
+    # fabric calls this before every command and transfer, and reconnects if the transport has
+    # died. make sure a reconnection gets keepalives and replaces the pooled client.
+    def open(self):
+        if self.is_connected:
+            return
         super().open()
+        self.transport.set_keepalive(ssh_keepalive_secs)
+        # commands and sftp requests are small writes that each wait on a reply. through a
+        # ProxyJump/ProxyCommand the transport rides a Channel or a pipe, which has no such option.
+        if isinstance(self.transport.sock, socket.socket):
+            self.transport.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        with ssh_clients_lock:
+            ssh_clients[(self.user, self.host, self.port)] = self.client
+
+    # fabric's put and get go through this. share one sftp session per host across
+    # wrappers, and open a new one only if the pooled session's transport has gone away.
+    def sftp(self):
+        self.open()
+        key = (self.user, self.host, self.port)
+        with ssh_clients_lock:
+            sftp = sftp_clients.get(key)
+            if sftp is None or sftp.get_channel().closed or sftp.get_channel().get_transport() is not self.transport:
+                sftp = self.client.open_sftp()
+                sftp_clients[key] = sftp
+        return sftp
+
+    def sftp_lock(self):
+        with ssh_clients_lock:
+            return sftp_locks.setdefault((self.user, self.host, self.port), threading.Lock())
 
     """
     Run a command on the remote machine
@@ -42,25 +178,15 @@ class ConnectionWrapper(Connection):
     ignore_out : shortcut to set stdout and stderr to /dev/null
     wd         : cd into this directory before running the given command
     sudo       : if true, execute this command with sudo (done AFTER changing to wd)
+    pty        : if true, run in a pty. off by default, since allocating one costs a round-trip;
+                 pass it with timeout= so the remote process is hung up when the timeout fires
 
     returns result struct
         .exited = return code
         .stdout = stdout string (if not redirected to a file)
         .stderr = stderr string (if not redirected to a file)
     """
-    def run(self, cmd, *args, stdin=None, stdout=None, stderr=None, ignore_out=False, wd=None, sudo=False, background=False, quiet=False, pty=True, **kwargs):
-        self.verbose = True
-        # Prepare command string
-        pre = ""
-        if wd:
-            pre += f"cd {wd} && "
-        if background:
-            pre += "screen -d -m "
-        #escape the strings
-        cmd = cmd.replace("\"", "\\\"")
-        if sudo:
-            pre += "sudo "
-        pre += "bash -c \""
+    def run(self, cmd, *args, stdin=None, stdout=None, stderr=None, ignore_out=False, wd=None, sudo=False, background=False, quiet=False, pty=False, **kwargs):
         if ignore_out:
             stdin="/dev/null"
             stdout="/dev/null"
@@ -68,15 +194,8 @@ class ConnectionWrapper(Connection):
         if background:
             stdin="/dev/null"
 
-        full_cmd = f"{pre}{cmd}"
-        if stdout is not None:
-            full_cmd  += f" > {stdout} "
-        if stderr is not None:
-            full_cmd  += f" 2> {stderr} "
-        if stdin is not None:
-            full_cmd  += f" < {stdin} "
-
-        full_cmd += "\""
+        # Prepare command string
+        full_cmd = self.build_cmd(cmd, stdin=stdin, stdout=stdout, stderr=stderr, wd=wd, sudo=sudo, background=background)
 
         # Prepare arguments for invoke/fabric
         if background:
@@ -89,41 +208,185 @@ class ConnectionWrapper(Connection):
         # Finally actually run it
         return super().run(full_cmd, *args, hide=True, warn=True, pty=pty, **kwargs)
 
+    # cd {wd} && [screen -d -m] [sudo] bash -c '{cmd} [> stdout] [2> stderr] [< stdin]'
+    #
+    # cmd is quoted as a whole, so the remote login shell passes it to bash untouched
+    # and it is parsed exactly once.
+    def build_cmd(self, cmd, stdin=None, stdout=None, stderr=None, wd=None, sudo=False, background=False):
+        if stdout is not None:
+            cmd += f" > {quote_path(stdout)}"
+        if stderr is not None:
+            cmd += f" 2> {quote_path(stderr)}"
+        if stdin is not None:
+            cmd += f" < {quote_path(stdin)}"
+
+        return f"{cmd_prefix(wd, sudo, background)}bash -c {shlex.quote(cmd)}"
+
+    """
+    Run several independent commands on the remote machine in a single ssh exec
+
+    Each command runs in its own subshell, so one failing does not stop the rest.
+    wd, sudo, and quiet are as in run().
+
+    returns a list of result structs, one per command, as run() would have
+    """
+    def run_batch(self, cmds, wd=None, sudo=False, quiet=False, **kwargs):
+        script = "".join(
+            f"( {c} ); printf '\\0{BATCH_SEP}%d\\0' $?; printf '\\0{BATCH_SEP}\\0' >&2; "
+            for c in cmds
+        )
+        full_cmd = self.build_cmd(script, wd=wd, sudo=sudo)
+
+        if not quiet:
+            agenda.subtask("[{}]{} {}".format(self.addr.ljust(10), " (batch) ", " ; ".join(cmds)))
+
+        res = super().run(full_cmd, hide=True, warn=True, pty=False, **kwargs)
+        outs = res.stdout.split(f"\0{BATCH_SEP}")
+        errs = res.stderr.split(f"\0{BATCH_SEP}\0")
+        if len(outs) < len(cmds) + 1:
+            # the batch itself did not run (e.g. bad wd), so neither did any command
+            return [res for _ in cmds]
+
+        results = []
+        out = outs[0]
+        for (i, c) in enumerate(cmds):
+            code, rest = outs[i + 1].split("\0", 1)
+            results.append(Result(connection=self, command=c, stdout=out, stderr=errs[i], exited=int(code)))
+            out = rest
+        return results
+
+    """
+    Run several dependent commands on the remote machine in a single ssh exec
+
+    The commands run in order, each in its own subshell (so a cd in one does not affect the
+    next), and the first failure stops the rest. wd, sudo, and quiet are as in run().
+
+    returns one result struct for the whole sequence; on failure, stderr says which step failed
+    """
+    def run_seq(self, cmds, **kwargs):
+        return self.run(seq_script(cmds), **kwargs)
+
+    """
+    Run cargo builds as in run_seq, unless they already succeeded at the current commit
+
+    builds : build commands, run from ~/burrito
+    stamp  : file (relative to ~/burrito) recording the commit and builds of the last success;
+             keep it in the target dir, so clearing the artifacts also forces a rebuild
+
+    The check happens remotely in the same command, so an up-to-date machine costs one
+    round-trip and no cargo invocation. A working tree with uncommitted changes always builds.
+    Scripts that share a target dir build the same binaries with different features, so a build
+    first removes every .last-built-* stamp in the stamp's directory: the others may no longer
+    describe what is on disk.
+    Build output goes to {stamp}.log on the remote machine rather than over ssh; on failure
+    only its last lines come back, in stderr.
+    """
+    def run_builds(self, builds, stamp, **kwargs):
+        key = hashlib.sha1("\n".join(builds).encode()).hexdigest()[:12]
+        log = quote_path(f"{stamp}.log")
+        stamp = quote_path(stamp)
+        return self.run(
+            f"h=\"$(git rev-parse HEAD)-{key}\"; "
+            f"if git diff --quiet HEAD && [ \"$(cat {stamp} 2> /dev/null)\" = \"$h\" ]; then echo \"already built $h\"; "
+            f"else d=\"$(dirname {stamp})\"; mkdir -p \"$d\"; find \"$d\" -maxdepth 1 -name '.last-built-*' ! -name '*.log' -delete; "
+            f"( {seq_script(builds)} ) > {log} 2>&1 || {{ r=$?; tail -n 40 {log} >&2; exit $r; }}; "
+            f"echo \"$h\" > {stamp}; fi",
+            wd="~/burrito",
+            **kwargs)
+
+    """
+    Start a command on its own channel of the shared ssh transport, bypassing fabric's runner
+
+    fabric's runner spins up reader threads and polls for input for every command, which
+    adds up when many clients run commands at once. This opens a session on the
+    (thread-safe) transport and leaves reading it to reap_channels, so one thread can wait
+    on many commands. Arguments are as in run(); background is not supported, and a pty is
+    allocated only when there is a timeout.
+
+    returns a StartedCmd to pass to reap_channels
+    """
+    def start_channel(self, cmd, stdin=None, stdout=None, stderr=None, ignore_out=False, wd=None, sudo=False, quiet=False, timeout=None):
+        if ignore_out:
+            stdin="/dev/null"
+            stdout="/dev/null"
+            stderr="/dev/null"
+        full_cmd = self.build_cmd(cmd, stdin=stdin, stdout=stdout, stderr=stderr, wd=wd, sudo=sudo)
+
+        if not quiet:
+            agenda.subtask("[{}]{} {}".format(self.addr.ljust(10), " (chan) ", full_cmd))
+
+        self.open()
+        chan = self.transport.open_session()
+        try:
+            if timeout is not None:
+                # as in run(): with a pty, closing the channel on timeout hangs up the process
+                chan.get_pty()
+            chan.exec_command(full_cmd)
+        except:
+            chan.close()
+            raise
+        deadline = time.time() + timeout if timeout is not None else None
+        return StartedCmd(self, chan, full_cmd, timeout, deadline)
+
+    """
+    Signal every process matching any of names, in a single round-trip
+
+    names : list of (process name, signal) pairs, e.g. [("kvserver", "INT"), ("iokerneld", "INT")]
+    """
+    def kill_all(self, names, **kwargs):
+        return self.run("; ".join(f"pkill -{sig} {name}" for (name, sig) in names) + "; true", sudo=True, **kwargs)
+
+    """
+    Wait for a shell condition to hold on the remote machine, polling in a remote loop so
+    the whole wait is a single round-trip
+
+    cond    : shell command that exits 0 once the condition holds
+    timeout : give up after this many seconds
+    sudo, quiet, etc. are as in run()
+
+    returns whether cond succeeded before the timeout
+    """
+    def wait_remote(self, cond, timeout=15, **kwargs):
+        res = self.run(f"until {cond}; do if [ $SECONDS -ge {timeout} ]; then exit 1; fi; sleep 0.2; done", **kwargs)
+        return res.exited == 0
+
     def check_code(self, ret) -> bool:
         return ret.exited == 0
 
+    @cache_probe
     def file_exists(self, fname, **kwargs):
         res = self.run(f"ls {fname}", **kwargs)
         return res.exited == 0
 
+    @cache_probe
     def prog_exists(self, prog, **kwargs):
         res = self.run(f"which {prog}", **kwargs)
         return res.exited == 0
 
-    def check_proc(self, proc_name, proc_outs):
-        res = self.run(f"pgrep {proc_name}")
+    # wait up to timeout seconds for proc_name to be running. the polling, and the tails of
+    # proc_outs on failure, happen in one remote script, so this is a single round-trip
+    # however long it waits.
+    def check_proc(self, proc_name, proc_outs, timeout=0):
+        tails = f"tail {' '.join(quote_path(o) for o in proc_outs)}"
+        res = self.run(f"until pgrep {proc_name} > /dev/null; do if [ $SECONDS -ge {timeout} ]; then {tails}; exit 1; fi; sleep 0.2; done")
         if res.exited != 0:
             agenda.subfailure(f'failed to find running process with name \"{proc_name}\" on {self.addr}')
-            for proc_out in proc_outs:
-                res = self.run(f'tail {proc_out}')
-                if res.exited == 0:
-                    print(res.command)
-                    print(res.stdout)
-                else:
-                    print(res)
+            print(res.stdout)
+            print(res.stderr)
             raise Exception("Process did not start correctly")
 
 
     def check_file(self, grep, where):
-        res = self.run(f"grep \"{grep}\" {where}")
+        res, tail = self.run_batch([f"grep \"{grep}\" {where}", f"tail {where}"])
         if res.exited != 0:
             agenda.subfailure(f"Unable to find search string (\"{grep}\") in process output file {where}")
-            res = self.run(f'tail {where}')
+            res = tail
             if res.exited == 0:
                 print(res.command)
                 print(res.stdout)
             sys.exit(1)
 
+    @cache_probe
     def local_path(self, path):
         r = self.run(f"ls {path}")
         return r.stdout.strip().replace("'", "")
@@ -139,7 +402,8 @@ class ConnectionWrapper(Connection):
                 remote
             ))
 
-        return super().put(local_file, remote, preserve_mode)
+        with self.sftp_lock():
+            return super().put(local_file, remote, preserve_mode)
 
     def get(self, remote_file, local=None, preserve_mode=True, quiet=False):
         if local is None:
@@ -152,12 +416,131 @@ class ConnectionWrapper(Connection):
                 local
             ))
 
-        return super().get(remote_file, local=local, preserve_mode=preserve_mode)
+        with self.sftp_lock():
+            return super().get(remote_file, local=local, preserve_mode=preserve_mode)
+
+    """
+    Fetch several files from the remote machine as one tar stream over a single channel,
+    rather than one sftp transfer per file.
+
+    remote_files : paths of the files to fetch; all must be in the same directory
+    local_files  : where to write each of remote_files locally
+
+    Files that exist are always fetched; if any are missing an exception is raised afterwards.
+    """
+    def get_many(self, remote_files, local_files, quiet=False):
+        remote_dir = os.path.dirname(remote_files[0])
+        if any(os.path.dirname(f) != remote_dir for f in remote_files):
+            raise Exception(f"get_many needs files from a single directory, got {remote_files}")
+        local = {os.path.basename(r): l for (r, l) in zip(remote_files, local_files)}
+        if not quiet:
+            agenda.subtask("[{}] tar {}:{}/{{{}}} -> localhost:{{{}}}".format(
+                self.addr,
+                self.addr,
+                remote_dir,
+                ','.join(local.keys()),
+                ','.join(local_files),
+            ))
+
+        if remote_dir.startswith("~/"):
+            remote_dir = remote_dir[2:]
+        self.open()
+        _, stdout, stderr = self.client.exec_command(
+            f"tar -C {shlex.quote(remote_dir if remote_dir else '.')} -cf - {' '.join(shlex.quote(n) for n in local)}")
+        try:
+            with tarfile.open(fileobj=stdout, mode='r|') as tar:
+                for member in tar:
+                    if member.isfile() and member.name in local:
+                        with open(local[member.name], 'wb') as f:
+                            shutil.copyfileobj(tar.extractfile(member), f)
+        except tarfile.ReadError:
+            pass # tar sent nothing, the exit code says why
+        if stdout.channel.recv_exit_status() != 0:
+            raise Exception(f"tar on {self.addr} failed: {stderr.read().decode('utf-8').strip()}")
 
 def get_local(filename, local=None, preserve_mode=True):
     assert(local is not None)
-    subprocess.run(f"mv {filename} {local}", shell=True)
+    # a rename when both are on one filesystem, otherwise a copy + delete like mv
+    try:
+        shutil.move(filename, local)
+    except FileNotFoundError:
+        agenda.subfailure(f"get_local: {filename} does not exist")
+
+
+# call fn on each item concurrently, one thread per item. returns the results in order,
+# and raises the first exception any call raised.
+def in_parallel(fn, items):
+    items = list(items)
+    if len(items) == 0:
+        return []
+    with ThreadPoolExecutor(max_workers=len(items)) as ex:
+        return list(ex.map(fn, items))
+
+# run the same command on every machine concurrently. returns the results in order.
+def parallel_run(machines, cmd, **kwargs):
+    return in_parallel(lambda m: m.run(cmd, **kwargs), machines)
+
+# wait for commands started with ConnectionWrapper.start_channel, from this one thread: a
+# selectors loop reads each channel's output as it arrives and collects its exit status.
+#
+# returns a result per command, in order. commands still running at their deadline are
+# closed, which hangs them up, and get a CommandTimedOut instead of a result. with
+# fail_fast, the first command to fail or time out also closes the rest, which get a
+# CommandCancelled: there is no point waiting out an experiment that has already failed.
+def reap_channels(started, fail_fast=False):
+    outs = [[] for _ in started]
+    errs = [[] for _ in started]
+    results = [None for _ in started]
+
+    def result(i, exited):
+        return Result(
+            connection=started[i].conn,
+            command=started[i].command,
+            stdout=b"".join(outs[i]).decode(errors="replace"),
+            stderr=b"".join(errs[i]).decode(errors="replace"),
+            exited=exited,
+        )
 
+    failed = False
+
+    # a channel's fileno becomes readable when output or eof arrives
+    sel = selectors.DefaultSelector()
+    for (i, s) in enumerate(started):
+        sel.register(s.chan, selectors.EVENT_READ, i)
+    try:
+        while sel.get_map():
+            deadlines = [started[k.data].deadline for k in sel.get_map().values() if started[k.data].deadline is not None]
+            wait = max(0, min(deadlines) - time.time()) if deadlines else None
+            for (key, _) in sel.select(wait):
+                i = key.data
+                chan = started[i].chan
+                while chan.recv_ready():
+                    outs[i].append(chan.recv(32768))
+                while chan.recv_stderr_ready():
+                    errs[i].append(chan.recv_stderr(32768))
+                if chan.exit_status_ready() and not chan.recv_ready() and not chan.recv_stderr_ready():
+                    sel.unregister(chan)
+                    results[i] = result(i, chan.recv_exit_status())
+                    failed = failed or results[i].exited != 0
+
+            now = time.time()
+            for key in list(sel.get_map().values()):
+                s = started[key.data]
+                if s.deadline is not None and now > s.deadline:
+                    sel.unregister(s.chan)
+                    results[key.data] = CommandTimedOut(result(key.data, -1), s.timeout)
+                    failed = True
+
+            if fail_fast and failed:
+                for key in list(sel.get_map().values()):
+                    sel.unregister(started[key.data].chan)
+                    results[key.data] = CommandCancelled(result(key.data, -1))
+    finally:
+        sel.close()
+        for s in started:
+            s.chan.close()
+
+    return results
 
 def check(ok, msg, addr, allowed=[]):
     # exit code 0 is always ok, allowed is in addition
@@ -180,37 +563,37 @@ def check_machine(ip):
     alt = ip['alt'] if 'alt' in ip else host
 
     conn = ConnectionWrapper(host, user=ip['user'] if 'user' in ip else None, port=ip['port'] if 'port' in ip else None)
-    if not conn.file_exists("~/burrito"):
-        agenda.failure(f"No burrito on {host}")
-        raise Exception(f"No burrito on {host}")
-
-    commit = conn.run("git rev-parse --short HEAD", wd = "~/burrito")
-    if commit.exited == 0:
-        commit = commit.stdout.strip()
+    key = (conn.user, conn.host, conn.port)
+    if key in machine_commits:
+        commit = machine_commits[key]
+    else:
+        ls, commit = conn.run_batch(["ls ~/burrito", "git -C ~/burrito rev-parse --short HEAD"])
+        if ls.exited != 0:
+            agenda.failure(f"No burrito on {host}")
+            raise Exception(f"No burrito on {host}")
+
+        if commit.exited == 0:
+            commit = commit.stdout.strip()
+        machine_commits[key] = commit
     agenda.subtask(f"burrito commit {commit} on {host}")
     conn.addr = addr
     conn.alt = alt
+    conn.commit = commit
     return (conn, commit)
 
 def setup_machine(conn, outdir, datapaths, dpdk_driver, target_dir):
     agenda.task(f"[{conn.addr}] setup machine")
     try:
         agenda.subtask(f"[{conn.addr}] make outdir {outdir}")
-        ok = conn.run(f"mkdir -p {target_dir if target_dir is not None else '~/burrito'}/{outdir}")
-        check(ok, "mk outdir", conn.addr)
-
         # dpdk dependencies, rust, and docker
-        ok = conn.run("bash scripts/install-kv-deps.sh", wd="~/burrito")
-        check(ok, "install dependencies", conn.addr)
+        ok = conn.run(f"set -e; mkdir -p {target_dir if target_dir is not None else '~/burrito'}/{outdir}; bash scripts/install-kv-deps.sh", wd="~/burrito")
+        check(ok, "mk outdir + install dependencies", conn.addr)
 
         if 'shenango_channel' in datapaths:
             agenda.subtask(f"[{conn.addr}] building shenango")
             # need to compile iokerneld
-            ok = conn.run("make", wd = "~/burrito/shenango-chunnel/caladan")
-            check(ok, "build shenango", conn.addr)
-
-            ok = conn.run("./scripts/setup_machine.sh", wd = "~/burrito/shenango-chunnel/caladan")
-            check(ok, "shenango setup-machine", conn.addr)
+            ok = conn.run("set -e; make; ./scripts/setup_machine.sh", wd = "~/burrito/shenango-chunnel/caladan")
+            check(ok, "build shenango + shenango setup-machine", conn.addr)
 
         if any('dpdk' in d for d in datapaths):
             ok = conn.run("./usertools/dpdk-hugepages.py -p 2M --setup 10G", wd = "~/burrito/dpdk-direct/dpdk-wrapper/dpdk", sudo=True)
@@ -221,6 +604,10 @@ def setup_machine(conn, outdir, datapaths, dpdk_driver, target_dir):
         thread_ok = False
         raise e
 
+# where run_builds records a successful build of kind, next to the artifacts
+def build_stamp(target_dir, kind):
+    return f"{target_dir}/burrito-target/.last-built-{kind}" if target_dir is not None else f"target/.last-built-{kind}"
+
 def compile_binaries(conn, outdir, datapaths, dpdk_driver, target_dir):
     try:
         needed_features = ["bin"]
@@ -241,18 +628,18 @@ def compile_binaries(conn, outdir, datapaths, dpdk_driver, target_dir):
         nightly = '+nightly' if 'shenango-chunnel' in needed_features else ''
         agenda.subtask(f"building kvserver features={needed_features}, target-dir {target_dir}, {nightly}")
         target_dir_arg = f"--target-dir {target_dir}/burrito-target" if target_dir is not None else ""
-        ok = conn.run(f"~/.cargo/bin/cargo {nightly} build --release --features=\"{','.join(needed_features)}\" --bin=\"kvserver\" {target_dir_arg}", wd = "~/burrito/kvstore")
-        check(ok, "kvserver build", conn.addr)
+        builds = [f"cd kvstore && ~/.cargo/bin/cargo {nightly} build --release --features=\"{','.join(needed_features)}\" --bin=\"kvserver\" {target_dir_arg}"]
 
         agenda.subtask(f"building ycsb features={needed_features}, {nightly}")
-        ok = conn.run(f"~/.cargo/bin/cargo {nightly} build --release --features=\"{','.join(needed_features[1:])}\" --bin=\"ycsb\" {target_dir_arg}", wd = "~/burrito/kvstore-ycsb")
-        check(ok, "ycsb build", conn.addr)
+        builds.append(f"cd kvstore-ycsb && ~/.cargo/bin/cargo {nightly} build --release --features=\"{','.join(needed_features[1:])}\" --bin=\"ycsb\" {target_dir_arg}")
 
         if 'dpdkmulti' in datapaths:
             needed_features = [f for f in needed_features if f == 'xl710_intel' or f == 'cx3_mlx' or f == 'cx4_mlx']
             agenda.subtask(f"building kv-dpdk features={needed_features} target-dir {target_dir}")
-            ok = conn.run(f"~/.cargo/bin/cargo build --release --features=\"{','.join(needed_features)}\" {target_dir_arg}", wd = "~/burrito/kv-dpdk")
-            check(ok, "kv-dpdk build", conn.addr)
+            builds.append(f"cd kv-dpdk && ~/.cargo/bin/cargo build --release --features=\"{','.join(needed_features)}\" {target_dir_arg}")
+
+        ok = conn.run_builds(builds, build_stamp(target_dir, "kv"))
+        check(ok, "build", conn.addr)
         return conn
     except Exception as e:
         agenda.failure(f"[{conn.addr}] setup_machine failed: {e}")
@@ -260,18 +647,13 @@ def compile_binaries(conn, outdir, datapaths, dpdk_driver, target_dir):
         thread_ok = False
         raise e
 
+# upload straight from memory: no local temp file, so concurrent writers cannot collide
 def write_cfg(conn, config, name):
-    from random import randint
-    fname = randint(1,1000)
-    fname = f"{fname}.config"
-    with open(f"{fname}", 'w') as f:
-        f.write(config)
-
-    agenda.subtask(f"[{conn.addr}] {name} config file: {fname}")
+    agenda.subtask(f"[{conn.addr}] {name} config file: {name}.config")
     if not conn.is_local:
-        conn.put(f"{fname}", f"~/burrito/{name}.config")
+        conn.put(io.BytesIO(config.encode()), f"~/burrito/{name}.config", quiet=True)
     else:
-        subprocess.run(f"rm -f {name}.config && cp {fname} {name}.config", shell=True)
+        pathlib.Path(f"{name}.config").write_text(config)
 
 def get_pci_addr(conn):
     search = None
@@ -335,14 +717,35 @@ ip = "{conn.addr}"
 """
     write_cfg(conn, dpdk_config, 'dpdk')
 
+# "./kvstore-ycsb/ycsbc-mock/wrkloadb-4.access" -> ("wrkloadb-4", 4 (client threads))
+@functools.lru_cache(maxsize=None)
+def workload_meta(wrkload):
+    wrkname = os.path.splitext(os.path.basename(wrkload))[0]
+    return (wrkname, int(wrkname.split('-')[-1]))
+
 def get_timeout_inner(num_reqs, interarrival_us) -> int:
     total_time_s = num_reqs * interarrival_us / 1e6
     return max(int(total_time_s * 2), 180)
 
+# (filename, mtime) -> number of lines, so each workload file is only read once per run
+wrkfile_lines = {}
+
+def count_lines(fname) -> int:
+    key = (fname, os.path.getmtime(fname))
+    if key not in wrkfile_lines:
+        num_lines = 0
+        last = b'\n'
+        with open(fname, 'rb') as f:
+            for blk in iter(lambda: f.read(1 << 20), b''):
+                num_lines += blk.count(b'\n')
+                last = blk[-1:]
+        # a last line without a trailing newline still counts
+        wrkfile_lines[key] = num_lines + (last != b'\n')
+    return wrkfile_lines[key]
+
 def get_timeout_local(wrkfile, interarrival_us) -> int:
-    with open(wrkfile, 'r') as f:
-        num_reqs = sum(1 for _ in f)
-        return get_timeout_inner(num_reqs, interarrival_us)
+    num_reqs = count_lines(wrkfile)
+    return get_timeout_inner(num_reqs, interarrival_us)
 
 def get_timeout_remote(conn, wrkfile, interarrival_us) -> int:
     res = conn.run(f"wc -l {wrkfile}", wd="~/burrito")
@@ -354,12 +757,40 @@ def get_timeout_remote(conn, wrkfile, interarrival_us) -> int:
 
 dpdk_ld_var = "LD_LIBRARY_PATH=/usr/local/lib64:/usr/local/lib:dpdk-direct/dpdk-wrapper/dpdk/build/lib/x86_64-linux-gnu"
 
+# poll until a process matching name is running (or, with running=False, until none is)
+def wait_proc(conn, name, running=True, timeout=15):
+    return conn.wait_remote(f"{'' if running else '! '}pgrep {name} > /dev/null", timeout=timeout, quiet=True)
+
+# (re)start iokerneld, first waiting for any previous instance to exit and release the nic
+def start_iokerneld(conn):
+    conn.kill_all([("iokerneld", "INT")])
+    wait_proc(conn, "iokerneld", running=False)
+    conn.run(f"./iokerneld ias nicpci {conn.pci_addr}", wd="~/burrito/shenango-chunnel/caladan", sudo=True, background=True)
+    if not wait_proc(conn, "iokerneld"):
+        agenda.subfailure(f"iokerneld did not start on {conn.addr}")
+        raise Exception(f"start iokerneld on {conn.addr}: not running after timeout")
+
+# wait until a server started on conn is serving. a kernel-datapath server's udp sockets show
+# up in ss, so wait for each of ports to be bound. the kernel-bypass datapaths own the nic and
+# bind nothing the kernel can see; for those, wait until the server has logged marker count
+# times to logf (relative to ~/burrito), which it does as it starts serving.
+def wait_serving(conn, datapath, ports, logf, marker, count=1, timeout=30):
+    if datapath == 'kernel':
+        cond = " && ".join(f"ss -Hlnu 'sport = :{p}' | grep -q ." for p in ports)
+    else:
+        cond = f"[ \"$(grep -c {shlex.quote(marker)} {quote_path(logf)} 2> /dev/null)\" -ge {count} ] 2> /dev/null"
+    if not conn.wait_remote(cond, timeout=timeout, wd="~/burrito", quiet=True):
+        agenda.subfailure(f"server on {conn.addr} not serving after {timeout}s")
+        print(conn.run(f"tail {quote_path(logf)}", wd="~/burrito", quiet=True).stdout)
+        raise Exception(f"server on {conn.addr} not serving after {timeout}s")
+
 def start_server(conn, redis_addr, outf, datapath='kernel', shards=1, skip_negotiation=False, bin_root="./target/release"):
-    conn.run("sudo pkill -INT kvserver")
-    conn.run("sudo pkill -INT iokerneld")
+    conn.kill_all([("kvserver", "INT"), ("iokerneld", "INT")])
+    # the previous server must release its port before the new one binds it
+    wait_proc(conn, "kvserver", running=False)
 
     if datapath == 'shenango_channel':
-        conn.run(f"./iokerneld ias nicpci {conn.pci_addr}", wd="~/burrito/shenango-chunnel/caladan", sudo=True, background=True)
+        start_iokerneld(conn)
         datapath = 'shenango'
         cfg = '--cfg=shenango.config'
     elif datapath == 'kernel':
@@ -371,7 +802,6 @@ def start_server(conn, redis_addr, outf, datapath='kernel', shards=1, skip_negot
 
     skip_neg = '--skip-negotiation' if skip_negotiation else ''
 
-    time.sleep(2)
     ok = conn.run(f"RUST_LOG=info {dpdk_ld_var} {bin_root}/kvserver --ip-addr {conn.addr} --port 4242 --num-shards {shards} --redis-addr={redis_addr} --datapath={datapath} {cfg} {skip_neg} --log",
             wd="~/burrito",
             sudo=True,
@@ -381,13 +811,17 @@ def start_server(conn, redis_addr, outf, datapath='kernel', shards=1, skip_negot
             )
     check(ok, "spawn server", conn.addr)
     agenda.subtask("wait for kvserver check")
-    time.sleep(8)
-    conn.check_proc(f"kvserver", [f"burrito/{outf}.err", f"burrito/{outf}.out"])
+    conn.check_proc(f"kvserver", [f"burrito/{outf}.err", f"burrito/{outf}.out"], timeout=15)
+    # with negotiation, the canonical server listens once every shard is up; without it there
+    # is only the shards
+    if skip_negotiation:
+        wait_serving(conn, datapath, [4242 + i for i in range(1, shards + 1)], f"{outf}.out", "listening", count=shards)
+    else:
+        wait_serving(conn, datapath, [4242], f"{outf}.out", "start canonical server")
 
 def start_server_no_chunnels(conn, outf, no_chunnels, shards=1, bin_root="./target/release"):
-    conn.run("sudo pkill -INT kvserver")
-    conn.run("sudo pkill -INT iokerneld")
-    time.sleep(2)
+    conn.kill_all([("kvserver", "INT"), ("iokerneld", "INT")])
+    wait_proc(conn, "kvserver", running=False)
     no_chunnels_arg = '--conns' if no_chunnels == 'conns' else ''
     ok = conn.run(f"RUST_LOG=info {dpdk_ld_var} {bin_root}/kvserver-dpdk \
             --addr {conn.addr}:4242 \
@@ -402,15 +836,16 @@ def start_server_no_chunnels(conn, outf, no_chunnels, shards=1, bin_root="./targ
             )
     check(ok, "spawn server", conn.addr)
     agenda.subtask("wait for kvserver check")
-    time.sleep(8)
-    conn.check_proc(f"kvserver", [f"{outf}.err"])
+    conn.check_proc(f"kvserver", [f"burrito/{outf}.err"], timeout=15)
 
 
-def run_client(conn, cfg_client, server, redis_addr, interarrival, poisson_arrivals, datapath, shardtype, skip_negotiation, outf, wrkfile, bin_root="./target/release"):
-    conn.run("sudo pkill -INT iokerneld")
+# set up a client machine and launch ycsb. returns the StartedCmd for reap_channels; pass
+# its result to finish_client.
+def start_client(conn, cfg_client, server, redis_addr, interarrival, poisson_arrivals, datapath, shardtype, skip_negotiation, outf, wrkfile, bin_root="./target/release"):
+    conn.kill_all([("iokerneld", "INT")])
 
     if datapath == 'shenango_channel':
-        conn.run(f"./iokerneld ias nicpci {conn.pci_addr}", wd="~/burrito/shenango-chunnel/caladan", sudo=True, background=True)
+        start_iokerneld(conn)
         datapath = 'shenango'
         cfg = '--cfg=shenango.config'
     elif datapath == 'kernel':
@@ -450,9 +885,8 @@ def run_client(conn, cfg_client, server, redis_addr, interarrival, poisson_arriv
     extra_cfg = ' '.join(f"--{key}={cfg_client[key]}" for key in cfg_client)
     outf = f"{outf}-{conn.addr}"
 
-    time.sleep(2)
     agenda.subtask(f"client starting, timeout {timeout} -> {outf}.out")
-    ok = conn.run(f"RUST_LOG=info {dpdk_ld_var} {bin_root}/ycsb \
+    return conn.start_channel(f"RUST_LOG=info {dpdk_ld_var} {bin_root}/ycsb \
             --addr {server}:4242 \
             --redis-addr={redis_addr} \
             -i {interarrival} \
@@ -471,26 +905,48 @@ def run_client(conn, cfg_client, server, redis_addr, interarrival, poisson_arriv
         stderr=f"{outf}.err",
         timeout=timeout,
         )
-    check(ok, "client", conn.addr)
-    conn.run("sudo pkill -INT iokerneld")
+
+# check a client's result from reap_channels, and clean up after it
+def finish_client(conn, res):
+    if isinstance(res, Exception):
+        # closing the channel hangs up ycsb, but make sure it and iokerneld are gone
+        conn.kill_all([("ycsb", "INT"), ("iokerneld", "INT")])
+        raise res
+    check(res, "client", conn.addr)
+    conn.kill_all([("iokerneld", "INT")])
     agenda.subtask("client done")
 
+# start the shard-info redis, or reuse (and flush) one a previous run left running. creating
+# the container is much slower than clearing it.
 def start_redis(machine):
-    machine.run("docker rm -f burrito-shard-redis", sudo=True)
     agenda.task("Starting redis")
+    running = machine.run("docker ps -q -f name=burrito-shard-redis", sudo=True, quiet=True)
+    if running.exited == 0 and running.stdout.strip():
+        flush_redis(machine)
+        agenda.subtask(f"Reusing redis on {machine.host}")
+        return f"{machine.alt}:6379"
+
+    machine.run("docker rm -f burrito-shard-redis", sudo=True)
     ok = machine.run("docker run \
             --name burrito-shard-redis \
             -d -p 6379:6379 redis:6",
             sudo=True,
             wd="~/burrito")
     check(ok, "start redis", machine.addr)
-    ok = machine.run("docker ps | grep burrito-shard-redis", sudo=True)
-    check(ok, "start redis", machine.addr)
+    if not machine.wait_remote("docker exec burrito-shard-redis redis-cli ping | grep -q PONG", timeout=30, sudo=True, quiet=True):
+        agenda.subfailure(f"redis did not answer ping on {machine.addr}")
+        raise Exception(f"start redis on {machine.addr}: no PONG after timeout")
     agenda.subtask(f"Started redis on {machine.host}")
     return f"{machine.alt}:6379"
 
-def run_client_no_chunnels(conn, cfg_client, server, num_shards, interarrival, poisson_arrivals, outf, wrkfile, bin_root="./target/release"):
-    conn.run("sudo pkill -INT iokerneld")
+# clear what the previous experiment's servers and clients left in redis, so one container
+# can be shared by every experiment in a run
+def flush_redis(machine):
+    ok = machine.run("docker exec burrito-shard-redis redis-cli FLUSHALL", sudo=True)
+    check(ok, "flush redis", machine.addr)
+
+def start_client_no_chunnels(conn, cfg_client, server, num_shards, interarrival, poisson_arrivals, outf, wrkfile, bin_root="./target/release"):
+    conn.kill_all([("iokerneld", "INT")])
     poisson_arg = "--poisson-arrivals" if poisson_arrivals  else ''
     timeout = None
     try:
@@ -506,9 +962,8 @@ def run_client_no_chunnels(conn, cfg_client, server, num_shards, interarrival, p
     extra_cfg = ' '.join(f"--{key}={cfg_client[key]}" for key in cfg_client)
     outf = f"{outf}-{conn.addr}"
 
-    time.sleep(2)
     agenda.subtask(f"client starting, timeout {timeout} -> {outf}.out")
-    ok = conn.run(f"RUST_LOG=info {dpdk_ld_var} {bin_root}/ycsb-dpdk \
+    return conn.start_channel(f"RUST_LOG=info {dpdk_ld_var} {bin_root}/ycsb-dpdk \
             --addr {server}:4242 \
             --num-shards {num_shards} \
             -i {interarrival} \
@@ -524,12 +979,9 @@ def run_client_no_chunnels(conn, cfg_client, server, num_shards, interarrival, p
         stderr=f"{outf}.err",
         timeout=timeout,
         )
-    check(ok, "client", conn.addr)
-    agenda.subtask("client done")
-    pass
 
 def run_loads(conn, cfg_client, server, datapath, redis_addr, outf, wrkfile, skip_negotiation=0, bin_root="./target/release"):
-    conn.run("sudo pkill -INT iokerneld")
+    conn.kill_all([("iokerneld", "INT")])
 
     skip_neg = ''
     while skip_negotiation > 0:
@@ -537,7 +989,6 @@ def run_loads(conn, cfg_client, server, datapath, redis_addr, outf, wrkfile, ski
         skip_negotiation -= 1
 
     if datapath == 'shenango_channel':
-        conn.run(f"./iokerneld ias nicpci {conn.pci_addr}", wd="~/burrito/shenango-chunnel/caladan", sudo=True, background=True)
         datapath = 'shenango'
         cfg = '--cfg=shenango.config'
     elif datapath == 'kernel':
@@ -550,10 +1001,10 @@ def run_loads(conn, cfg_client, server, datapath, redis_addr, outf, wrkfile, ski
     extra_cfg = ' '.join(f"--{key}={cfg_client[key]}" for key in cfg_client)
 
     while True:
+        # each attempt kills iokerneld when it is done, so start a fresh one
         if 'shenango' in datapath:
-            conn.run("./iokerneld", wd="~/burrito/shenango-chunnel/caladan", sudo=True, background=True)
+            start_iokerneld(conn)
 
-        time.sleep(2)
         loads_start = time.time()
         agenda.subtask(f"loads client starting")
         ok = None
@@ -573,11 +1024,12 @@ def run_loads(conn, cfg_client, server, datapath, redis_addr, outf, wrkfile, ski
                 stdout=f"{outf}-loads.out",
                 stderr=f"{outf}-loads.err",
                 timeout=30,
+                pty=True,
                 )
         except:
             agenda.subfailure(f"loads failed, retrying after {time.time() - loads_start} s")
         finally:
-            conn.run("sudo pkill -INT iokerneld")
+            conn.kill_all([("iokerneld", "INT")])
         if ok is None or ok.exited != 0:
             agenda.subfailure(f"loads failed, retrying after {time.time() - loads_start} s")
             continue
@@ -586,11 +1038,10 @@ def run_loads(conn, cfg_client, server, datapath, redis_addr, outf, wrkfile, ski
             break
 
 def run_loads_no_chunnels(conn, cfg_client, server, num_shards, outf, wrkfile, bin_root="./target/release"):
-    conn.run("sudo pkill -INT iokerneld")
+    conn.kill_all([("iokerneld", "INT")])
     extra_cfg = ' '.join(f"--{key}={cfg_client[key]}" for key in cfg_client)
 
     while True:
-        time.sleep(2)
         loads_start = time.time()
         agenda.subtask(f"loads client starting")
         ok = None
@@ -608,11 +1059,12 @@ def run_loads_no_chunnels(conn, cfg_client, server, num_shards, outf, wrkfile, b
                 stdout=f"{outf}-loads.out",
                 stderr=f"{outf}-loads.err",
                 timeout=30,
+                pty=True,
                 )
         except:
             agenda.subfailure(f"loads failed, retrying after {time.time() - loads_start} s")
         finally:
-            conn.run("sudo pkill -INT iokerneld")
+            conn.kill_all([("iokerneld", "INT")])
         if ok is None or ok.exited != 0:
             agenda.subfailure(f"loads failed, retrying after {time.time() - loads_start} s")
             continue
@@ -629,100 +1081,110 @@ def local_path(outf, orig_outdir):
             return '/'.join([dr] + sp[i:])
     raise Exception(f"{orig_outdir} not found in {outf}")
 
-def do_exp(iter_num,
+def nochunnels_suffix(no_chunnels):
+    if no_chunnels == 'full' or no_chunnels == True:
+        return '_nochunnels'
+    elif no_chunnels == 'conns':
+        return '_nochunnels_conns'
+    else:
+        return ''
+
+# common prefix of every output file of the experiment with these parameters
+def exp_prefix(outdir, iter_num, datapath=None, skip_negotiation=None, no_chunnels=False, num_shards=None, shardtype=None, ops_per_sec=None, poisson_arrivals=None, wrkload=None):
+    wrkname, _ = workload_meta(wrkload)
+    noneg = '_noneg' if skip_negotiation else ''
+    nochunnels = nochunnels_suffix(no_chunnels)
+    return f"{outdir}/{datapath}{noneg}{nochunnels}-{num_shards}-{shardtype}shard-{ops_per_sec}-poisson={poisson_arrivals}-{wrkname}-{iter_num}"
+
+# the local file whose presence means the experiment with these parameters already ran
+def exp_done_file(outdir, machines, iter_num, **params):
+    return f"{exp_prefix(outdir, iter_num, **params)}-client-{machines[1].addr}.data"
+
+# parameters the server process depends on. experiments that agree on these can share one
+# server (and one round of loads); the others (shardtype, load, poisson arrivals) only
+# change how the clients run.
+server_params = ['datapath', 'skip_negotiation', 'no_chunnels', 'num_shards', 'wrkload']
+
+# common prefix of the server's (and loads client's) output files for a server configuration
+def exp_server_prefix(outdir, iter_num, datapath=None, skip_negotiation=None, no_chunnels=False, num_shards=None, wrkload=None):
+    wrkname, _ = workload_meta(wrkload)
+    noneg = '_noneg' if skip_negotiation else ''
+    nochunnels = nochunnels_suffix(no_chunnels)
+    return f"{outdir}/{datapath}{noneg}{nochunnels}-{num_shards}-{wrkname}-{iter_num}"
+
+# create outdir (relative to ~/burrito) on every machine. output files are named by every
+# grid axis, so earlier results are left in place. file_exists caches hits, so after the
+# first call for an outdir this costs no round-trips.
+def make_outdirs(machines, outdir):
+    outdir_path = outdir if outdir.startswith('/') else f"~/burrito/{outdir}"
+    def make_outdir(m):
+        if not m.file_exists(outdir_path, quiet=True):
+            m.run(f"mkdir -p {outdir}", wd="~/burrito")
+    in_parallel(make_outdir, machines)
+
+def no_chunnels_supported(no_chunnels, datapath, shardtype):
+    return (no_chunnels == 'off' or no_chunnels == False) or (datapath == 'dpdkmulti' and shardtype == 'client')
+
+@functools.lru_cache
+def proj_dir(conn):
+    res = conn.run("ls /proj/")
+    return f"/proj/{res.stdout.strip().split()[0]}"
+
+# (target_dir, outdir, bin_root) for experiments. on cloudlab, outputs and binaries live on
+# the shared /proj filesystem instead of under ~/burrito.
+def exp_dirs(machines, outdir, cloudlab):
+    if not cloudlab:
+        return None, outdir, "./target/release"
+    target_dir = proj_dir(machines[0])
+    return target_dir, f"{target_dir}/{outdir}", f"{target_dir}/burrito-target/release"
+
+def start_experiment_server(iter_num,
     outdir=None,
     machines=None,
-    num_shards=None,
-    shardtype=None,
-    ops_per_sec=None,
     datapath=None,
-    poisson_arrivals=None,
     skip_negotiation=None,
+    no_chunnels=False,
+    num_shards=None,
     wrkload=None,
-    overwrite=None,
     cfg_client=None,
-    no_chunnels=False,
     cloudlab=False,
+    redis_addr=None,
 ):
     assert(
         outdir is not None and
         machines is not None and
         num_shards is not None and
-        shardtype is not None and
-        ops_per_sec is not None and
         datapath is not None and
-        poisson_arrivals is not None and
         skip_negotiation is not None and
-        wrkload is not None and
-        overwrite is not None
+        wrkload is not None
     )
 
-    target_dir = None
     orig_outdir = outdir
-    if cloudlab:
-        res = machines[0].run("ls /proj/")
-        target_dir = f"/proj/{res.stdout.strip().split()[0]}"
-        outdir = f"{target_dir}/{outdir}"
+    target_dir, outdir, bin_root_dir = exp_dirs(machines, outdir, cloudlab)
+    params = dict(datapath=datapath, skip_negotiation=skip_negotiation, no_chunnels=no_chunnels, num_shards=num_shards, wrkload=wrkload)
+    server_prefix = exp_server_prefix(outdir, iter_num, **params)
 
-    if (no_chunnels != 'off' and no_chunnels != False) and (datapath != 'dpdkmulti' or shardtype != 'client'):
-        agenda.task("skipping: no_chunnels mode supported only for dpdkmulti + client sharding")
-        return
-
-    wrkname = wrkload.split("/")[-1].split(".")[0]
-    noneg = '_noneg' if skip_negotiation else ''
-    if no_chunnels == 'full' or no_chunnels == True:
-       nochunnels  = '_nochunnels'
-    elif no_chunnels == 'conns':
-       nochunnels = '_nochunnels_conns'
-    else:
-       nochunnels = ''
-
-    server_prefix = f"{outdir}/{datapath}{noneg}{nochunnels}-{num_shards}-{shardtype}shard-{ops_per_sec}-poisson={poisson_arrivals}-{wrkname}-{iter_num}-kvserver"
-    outf = f"{outdir}/{datapath}{noneg}{nochunnels}-{num_shards}-{shardtype}shard-{ops_per_sec}-poisson={poisson_arrivals}-{wrkname}-{iter_num}-client"
-
-    for m in machines:
-        if m.is_local:
-            m.run(f"mkdir -p {outdir}", wd="~/burrito")
-            continue
-        m.run(f"rm -rf {outdir}", wd="~/burrito")
-        m.run(f"mkdir -p {outdir}", wd="~/burrito")
-
-    if not overwrite and os.path.exists(f"{outf}0-{machines[1].addr}.data"):
-        agenda.task(f"skipping: server = {machines[0].addr}, datapath = {datapath}, skip_negotiation = {skip_negotiation}, no_chunnels = {no_chunnels}, num_shards = {num_shards}, shardtype = {shardtype}, load = {ops_per_sec} ops/s")
-        return True
-    else:
-        agenda.task(f"running: {outf}0-{machines[1].addr}.data")
-
-    # load = (n (client threads / proc) * 1 (procs/machine) * {len(machines) - 1} (machines))
-    #        / {interarrival} (per client thread)
-    num_client_threads = int(wrkname.split('-')[-1])
-    interarrival_secs = num_client_threads * len(machines[1:]) / ops_per_sec
-    interarrival_us = int(interarrival_secs * 1e6)
+    make_outdirs(machines, outdir)
 
+    nochunnels = nochunnels_suffix(no_chunnels)
     if not no_chunnels:
-        redis_addr = start_redis(machines[0])
-        time.sleep(5)
+        assert redis_addr is not None, "start_redis before running experiments that use it"
+        flush_redis(machines[0])
     else:
         redis_addr = ""
 
     server_addr = machines[0].addr
-    agenda.task(f"starting: server = {machines[0].addr}, datapath = {datapath}, num_shards = {num_shards}, shardtype = {shardtype}, load = {ops_per_sec} ops/s -> interarrival_us = {interarrival_us}, num_clients = {len(machines)-1}")
-
-    bin_root_dir = f"{target_dir}/burrito-target/release" if target_dir is not None else "./target/release"
-    # first one is the server, start the server
-    agenda.subtask("starting server")
+    agenda.task(f"starting server: server = {server_addr}, datapath = {datapath}, skip_negotiation = {skip_negotiation}, no_chunnels = {no_chunnels}, num_shards = {num_shards}")
     if len(nochunnels) > 0:
-        start_server_no_chunnels(machines[0], server_prefix, no_chunnels, shards=num_shards, bin_root=bin_root_dir)
-        time.sleep(5)
+        start_server_no_chunnels(machines[0], f"{server_prefix}-kvserver", no_chunnels, shards=num_shards, bin_root=bin_root_dir)
     else:
         redis_port = redis_addr.split(":")[-1]
-        start_server(machines[0], f"127.0.0.1:{redis_port}", server_prefix, datapath=datapath, shards=num_shards, skip_negotiation=skip_negotiation, bin_root=bin_root_dir)
-        time.sleep(5)
+        start_server(machines[0], f"127.0.0.1:{redis_port}", f"{server_prefix}-kvserver", datapath=datapath, shards=num_shards, skip_negotiation=skip_negotiation, bin_root=bin_root_dir)
 
     # prime the server with loads
     agenda.task("doing loads")
     if no_chunnels:
-        run_loads_no_chunnels(machines[1], cfg_client, server_addr, num_shards, outf, wrkload, bin_root=bin_root_dir)
+        run_loads_no_chunnels(machines[1], cfg_client, server_addr, num_shards, server_prefix, wrkload, bin_root=bin_root_dir)
     else:
         run_loads(
             machines[1],
@@ -730,103 +1192,126 @@ def do_exp(iter_num,
             server_addr,
             datapath,
             redis_addr,
-            outf,
+            server_prefix,
             wrkload,
             skip_negotiation=num_shards if skip_negotiation else 0,
             bin_root=bin_root_dir
         )
 
-    get_fn = f"{'' if cloudlab else 'burrito/'}{outf}-loads"
-    loc = local_path(f"{outf}-loads", orig_outdir) if cloudlab else f"{outf}-loads"
+    get_fn = f"{'' if cloudlab else 'burrito/'}{server_prefix}-loads"
+    loc = local_path(f"{server_prefix}-loads", orig_outdir) if cloudlab else f"{server_prefix}-loads"
     try:
-        machines[1].get(get_fn+".out", local=loc+".out", preserve_mode=False)
-        machines[1].get(get_fn+".err", local=loc+".err", preserve_mode=False)
+        machines[1].get_many([get_fn+".out", get_fn+".err"], [loc+".out", loc+".err"])
     except Exception as e:
         agenda.subfailure(f"Could not get file {loc}.[out,err] from loads client: {e}")
 
-    # others are clients
-    agenda.task("starting clients")
-    if no_chunnels:
-        clients = [threading.Thread(target=run_client_no_chunnels, args=(
-                m,
-                cfg_client,
-                server_addr,
-                num_shards,
-                interarrival_us,
-                poisson_arrivals,
-                outf,
-                wrkload
-            ),
-            kwargs={'bin_root': bin_root_dir}
-        ) for m in machines[1:]]
-    else:
-        clients = [threading.Thread(target=run_client, args=(
-                m,
-                cfg_client,
-                server_addr,
-                redis_addr,
-                interarrival_us,
-                poisson_arrivals,
-                datapath,
-                shardtype,
-                num_shards if skip_negotiation else 0,
-                outf,
-                wrkload
-            ),
-            kwargs={'bin_root': bin_root_dir}
-        ) for m in machines[1:]]
-
-    [t.start() for t in clients]
-    [t.join() for t in clients]
-    agenda.task("all clients returned")
+def stop_experiment_server(iter_num,
+    outdir=None,
+    machines=None,
+    cloudlab=False,
+    **params,
+):
+    orig_outdir = outdir
+    _, outdir, _ = exp_dirs(machines, outdir, cloudlab)
+    server_prefix = f"{exp_server_prefix(outdir, iter_num, **params)}-kvserver"
 
-    # kill the server
-    machines[0].run("sudo pkill -INT kvserver")
-    machines[0].run("sudo pkill -INT iokerneld")
+    machines[0].kill_all([("kvserver", "INT"), ("iokerneld", "INT")])
 
     agenda.task("get server files")
     if not machines[0].is_local:
         get_fn = f"{'' if cloudlab else 'burrito/'}{server_prefix}"
         loc = local_path(f"{server_prefix}", orig_outdir) if cloudlab else f"{server_prefix}"
-        machines[0].get(get_fn +'.out', local=loc +'.out', preserve_mode=False)
-        machines[0].get(get_fn +'.err', local=loc +'.err', preserve_mode=False)
+        machines[0].get_many([get_fn +'.out', get_fn +'.err'], [loc +'.out', loc +'.err'])
 
-    def get_files(c):
-        fn = c.get
-        if c.is_local:
-            agenda.subtask(f"Use get_local: {c.host}")
-            fn = get_local
+# run one experiment's clients against the server start_experiment_server started
+def run_experiment_clients(iter_num,
+    outdir=None,
+    machines=None,
+    num_shards=None,
+    shardtype=None,
+    ops_per_sec=None,
+    datapath=None,
+    poisson_arrivals=None,
+    skip_negotiation=None,
+    wrkload=None,
+    cfg_client=None,
+    no_chunnels=False,
+    cloudlab=False,
+    redis_addr=None,
+):
+    assert(
+        outdir is not None and
+        machines is not None and
+        num_shards is not None and
+        shardtype is not None and
+        ops_per_sec is not None and
+        datapath is not None and
+        poisson_arrivals is not None and
+        skip_negotiation is not None and
+        wrkload is not None
+    )
+
+    params = dict(
+        datapath=datapath,
+        skip_negotiation=skip_negotiation,
+        no_chunnels=no_chunnels,
+        num_shards=num_shards,
+        shardtype=shardtype,
+        ops_per_sec=ops_per_sec,
+        poisson_arrivals=poisson_arrivals,
+        wrkload=wrkload,
+    )
+    orig_outdir = outdir
+    _, outdir, bin_root_dir = exp_dirs(machines, outdir, cloudlab)
+    outf = f"{exp_prefix(outdir, iter_num, **params)}-client"
+    if no_chunnels:
+        redis_addr = ""
+
+    _, num_client_threads = workload_meta(wrkload)
+    # load = (n (client threads / proc) * 1 (procs/machine) * {len(machines) - 1} (machines))
+    #        / {interarrival} (per client thread)
+    interarrival_secs = num_client_threads * len(machines[1:]) / ops_per_sec
+    interarrival_us = int(interarrival_secs * 1e6)
 
+    server_addr = machines[0].addr
+    agenda.task(f"starting: server = {server_addr}, datapath = {datapath}, num_shards = {num_shards}, shardtype = {shardtype}, load = {ops_per_sec} ops/s -> interarrival_us = {interarrival_us}, num_clients = {len(machines)-1}")
+
+    # others are clients. start them all (the setup before ycsb runs concurrently), then
+    # wait for every ycsb from this thread.
+    agenda.task("starting clients")
+    def start(m):
+        try:
+            if no_chunnels:
+                return start_client_no_chunnels(m, cfg_client, server_addr, num_shards, interarrival_us, poisson_arrivals, outf, wrkload, bin_root=bin_root_dir)
+            else:
+                return start_client(m, cfg_client, server_addr, redis_addr, interarrival_us, poisson_arrivals, datapath, shardtype, num_shards if skip_negotiation else 0, outf, wrkload, bin_root=bin_root_dir)
+        except Exception as e:
+            agenda.subfailure(f"[{m.addr}] client did not start: {e}")
+            return None
+
+    started = [(m, s) for (m, s) in zip(machines[1:], in_parallel(start, machines[1:])) if s is not None]
+    results = reap_channels([s for (_, s) in started], fail_fast=True)
+    for ((m, _), res) in zip(started, results):
+        try:
+            finish_client(m, res)
+        except Exception as e:
+            agenda.subfailure(f"[{m.addr}] client failed: {e}")
+    agenda.task("all clients returned")
+
+    def get_files(c):
         get_fn = f"{'' if cloudlab else 'burrito/'}{outf}-{c.addr}"
         loc = local_path(f"{outf}-{c.addr}", orig_outdir) if cloudlab else f"{outf}-{c.addr}"
+        exts = ["err", "out", "data", "trace"]
 
-        agenda.subtask(f"getting {get_fn}.err")
-        fn(
-            f"{get_fn}.err",
-            local=f"{loc}.err",
-            preserve_mode=False,
-        )
-        agenda.subtask(f"getting {get_fn}.out")
-        fn(
-            f"{get_fn}.out",
-            local=f"{loc}.out",
-            preserve_mode=False,
-        )
-        agenda.subtask(f"getting {get_fn}.data")
-        fn(
-            f"{get_fn}.data",
-            local=f"{loc}.data",
-            preserve_mode=False,
-        )
-        agenda.subtask(f"getting {get_fn}.trace")
-        fn(
-            f"{get_fn}.trace",
-            local=f"{loc}.trace",
-            preserve_mode=False,
-        )
+        if c.is_local:
+            agenda.subtask(f"Use get_local: {c.host}")
+            for ext in exts:
+                agenda.subtask(f"getting {get_fn}.{ext}")
+                get_local(f"{get_fn}.{ext}", local=f"{loc}.{ext}", preserve_mode=False)
+        else:
+            c.get_many([f"{get_fn}.{ext}" for ext in exts], [f"{loc}.{ext}" for ext in exts])
 
-    agenda.task("get client files")
-    for c in machines[1:]:
+    def get_client_files(c):
         try:
             get_files(c)
             #agenda.subtask("getting perf")
@@ -837,9 +1322,18 @@ def do_exp(iter_num,
         except Exception as e:
             agenda.subfailure(f"At least one file missing for {c}: {e}")
 
+    agenda.task("get client files")
+    in_parallel(get_client_files, machines[1:])
+
     agenda.task("done")
     return True
 
+# generate whichever of wrkfiles conn does not have yet
+def ensure_ycsb_files(conn, wrkfiles):
+    for w in wrkfiles:
+        if not conn.file_exists(w):
+            generate_ycsb_file(conn, w)
+
 def generate_ycsb_file(conn, wrkfile):
     # "./kvstore-ycsb/ycsbc-mock/wrkloadb-4.access" -> wrkloadb-4
     slug = wrkfile.strip().split('/')[-1].split('.')[0]
@@ -857,34 +1351,32 @@ def generate_ycsb_file(conn, wrkfile):
         if ok.exited != 0:
             raise Exception(f"augment script failed: {ok}")
 
-def intel_setup(machines):
-    agenda.task("setup intel-driver machine for DPDK")
-    for conn in machines:
-        ok = conn.run("lsmod | grep uio", wd = "~/burrito/dpdk-direct/dpdk-wrapper/dpdk")
-        if ok.exited != 0:
-            agenda.subtask("igb_uio kmod not loaded")
+def intel_setup_one(conn):
+    ok = conn.run("lsmod | grep uio", wd = "~/burrito/dpdk-direct/dpdk-wrapper/dpdk")
+    if ok.exited != 0:
+        agenda.subtask("igb_uio kmod not loaded")
 
-            # igb_uio
-            ok = conn.run("modprobe uio", wd = "~/burrito/dpdk-direct/dpdk-wrapper/dpdk", sudo=True)
-            check(ok, "modprobe uio", conn.addr)
+        # igb_uio
+        ok = conn.run("modprobe uio", wd = "~/burrito/dpdk-direct/dpdk-wrapper/dpdk", sudo=True)
+        check(ok, "modprobe uio", conn.addr)
 
-            ok = conn.run("ls ./dpdk-kmods/linux/igb_uio/igb_uio.ko", wd = "~")
+        ok = conn.run("ls ./dpdk-kmods/linux/igb_uio/igb_uio.ko", wd = "~")
+        if ok.exited != 0:
+            agenda.subtask("igb_uio kmod not cloned or built")
+            ok = conn.run("ls ./dpdk-kmods", wd = "~")
             if ok.exited != 0:
-                agenda.subtask("igb_uio kmod not cloned or built")
-                ok = conn.run("ls ./dpdk-kmods", wd = "~")
-                if ok.exited != 0:
-                    # need to clone
-                    ok = conn.run("git clone https://dpdk.org/git/dpdk-kmods", wd = "~")
-                    check(ok, "clone dpdk-kmods", conn.addr)
-
-                agenda.subtask("compiling igb_uio")
-                # now can make
-                ok = conn.run("make", wd = "~/dpdk-kmods/linux/igb_uio")
-                check(ok, "build igb_uio", conn.addr)
-
-            agenda.subtask("inserting igb_uio kmod")
-            ok = conn.run("insmod ./igb_uio.ko", wd = "~/dpdk-kmods/linux/igb_uio", sudo=True)
-            check(ok, "modprobe igb_uio", conn.addr)
+                # need to clone
+                ok = conn.run("git clone https://dpdk.org/git/dpdk-kmods", wd = "~")
+                check(ok, "clone dpdk-kmods", conn.addr)
+
+            agenda.subtask("compiling igb_uio")
+            # now can make
+            ok = conn.run("make", wd = "~/dpdk-kmods/linux/igb_uio")
+            check(ok, "build igb_uio", conn.addr)
+
+        agenda.subtask("inserting igb_uio kmod")
+        ok = conn.run("insmod ./igb_uio.ko", wd = "~/dpdk-kmods/linux/igb_uio", sudo=True)
+        check(ok, "modprobe igb_uio", conn.addr)
 
 def get_iface(ip_link_out, mac):
     for line in ip_link_out.split('\n'):
@@ -908,76 +1400,71 @@ def mlx_ofed_install_one(conn):
         thread_ok = False
     agenda.subtask("mlx ofed installed")
 
-def mlx_ofed_install(machines):
-    installs = [threading.Thread(target=mlx_ofed_install_one, args=(m,)) for m in machines]
-    [i.start() for i in installs]
-    [i.join() for i in installs]
-    if not thread_ok:
-        raise Exception("mlx install failed")
+def intel_devbind_one(conn, datapath):
+    # first determine the current driver assignment
+    res = conn.run(f"./usertools/dpdk-devbind.py --status-dev net | grep 'drv=igb_uio'", wd="~/burrito/dpdk-direct/dpdk-wrapper/dpdk", sudo=True)
+    if res.exited != 0 and 'dpdk' in datapath:
+        agenda.subtask(f"[{conn.addr}] bind to DPDK driver")
+        # Kernel -> DPDK
+        # 0. get the iface and pci_addr
+        res = conn.run("ip -o link")
+        check(res, "ip link", conn.addr)
+        ip_link_out = res.stdout
+        iface = get_iface(ip_link_out, conn.mac)
+        conn.exp_iface = iface
+        res = conn.run(f"./usertools/dpdk-devbind.py --status-dev net | grep '{iface}' | cut -d' ' -f1", wd="~/burrito/dpdk-direct/dpdk-wrapper/dpdk", sudo=True)
+        check(res, "dpdk-devbind show", conn.addr)
+        pci_addr = res.stdout.strip()
+        agenda.subtask(f"[{conn.addr}] pci: {pci_addr} iface: {iface}")
+
+        # 1. ip link set dev {interface} down
+        ok = conn.run(f"ip link set dev {iface} down", sudo=True)
+        check(ok, "ip link set down", conn.addr)
+
+        # 2. dpdk-devbind --bind igb_uio {pci_addr}
+        ok = conn.run(f"./usertools/dpdk-devbind.py --bind=\"igb_uio\" {pci_addr}", wd="~/burrito/dpdk-direct/dpdk-wrapper/dpdk", sudo=True)
+        check(ok, "dpdk-devbind bind", conn.addr)
+    elif res.exited == 0 and datapath == 'kernel':
+        agenda.subtask(f"[{conn.addr}] bind to kernel driver")
+        # DPDK -> Kernel
+        pci_addr = res.stdout.strip().split()[0]
+        # 1. dpdk-devbind --bind i40e {pci_addr}
+        ok = conn.run(f"./usertools/dpdk-devbind.py --bind=\"i40e\" {pci_addr}", wd="~/burrito/dpdk-direct/dpdk-wrapper/dpdk", sudo=True)
+        check(ok, "dpdk-devbind bind", conn.addr)
+
+        # 2. ip link set dev {interface} up
+        res = conn.run("ip -o link")
+        check(res, "ip link", conn.addr)
+        ip_link_out = res.stdout
+        iface = get_iface(ip_link_out, conn.mac)
+        conn.exp_iface = iface
+
+        ok = conn.run(f"ip link set dev {iface} up", sudo=True)
+        check(ok, "ip link set up", conn.addr)
+
+        # 3. ip addr add dev {interface} {addr}/24
+        ok = conn.run(f"ip addr add dev {iface} {conn.addr}/24", sudo=True)
+        check(ok, "ip addr add", conn.addr)
+    else:
+        agenda.subtask("correct driver already bound")
+    agenda.subtask(f"[{conn.addr}] done")
 
 def intel_devbind(machines, datapath):
     agenda.task(f"bind interfaces to correct driver for {datapath}")
-    for conn in machines:
-        # first determine the current driver assignment
-        res = conn.run(f"./usertools/dpdk-devbind.py --status-dev net | grep 'drv=igb_uio'", wd="~/burrito/dpdk-direct/dpdk-wrapper/dpdk", sudo=True)
-        if res.exited != 0 and 'dpdk' in datapath:
-            agenda.subtask(f"[{conn.addr}] bind to DPDK driver")
-            # Kernel -> DPDK
-            # 0. get the iface and pci_addr
-            res = conn.run("ip -o link")
-            check(res, "ip link", conn.addr)
-            ip_link_out = res.stdout
-            iface = get_iface(ip_link_out, conn.mac)
-            conn.exp_iface = iface
-            res = conn.run(f"./usertools/dpdk-devbind.py --status-dev net | grep '{iface}' | cut -d' ' -f1", wd="~/burrito/dpdk-direct/dpdk-wrapper/dpdk", sudo=True)
-            check(res, "dpdk-devbind show", conn.addr)
-            pci_addr = res.stdout.strip()
-            agenda.subtask(f"[{conn.addr}] pci: {pci_addr} iface: {iface}")
-
-            # 1. ip link set dev {interface} down
-            ok = conn.run(f"ip link set dev {iface} down", sudo=True)
-            check(ok, "ip link set down", conn.addr)
-
-            # 2. dpdk-devbind --bind igb_uio {pci_addr}
-            ok = conn.run(f"./usertools/dpdk-devbind.py --bind=\"igb_uio\" {pci_addr}", wd="~/burrito/dpdk-direct/dpdk-wrapper/dpdk", sudo=True)
-            check(ok, "dpdk-devbind bind", conn.addr)
-        elif res.exited == 0 and datapath == 'kernel':
-            agenda.subtask(f"[{conn.addr}] bind to kernel driver")
-            # DPDK -> Kernel
-            pci_addr = res.stdout.strip().split()[0]
-            # 1. dpdk-devbind --bind i40e {pci_addr}
-            ok = conn.run(f"./usertools/dpdk-devbind.py --bind=\"i40e\" {pci_addr}", wd="~/burrito/dpdk-direct/dpdk-wrapper/dpdk", sudo=True)
-            check(ok, "dpdk-devbind bind", conn.addr)
-
-            # 2. ip link set dev {interface} up
-            res = conn.run("ip -o link")
-            check(res, "ip link", conn.addr)
-            ip_link_out = res.stdout
-            iface = get_iface(ip_link_out, conn.mac)
-            conn.exp_iface = iface
-
-            ok = conn.run(f"ip link set dev {iface} up", sudo=True)
-            check(ok, "ip link set up", conn.addr)
-
-            # 3. ip addr add dev {interface} {addr}/24
-            ok = conn.run(f"ip addr add dev {iface} {conn.addr}/24", sudo=True)
-            check(ok, "ip addr add", conn.addr)
-        else:
-            agenda.subtask("correct driver already bound")
-        agenda.subtask(f"[{conn.addr}] done")
+    in_parallel(lambda conn: intel_devbind_one(conn, datapath), machines)
 
 def connect_machines(cfg):
     agenda.task(f"Checking for connection vs experiment ip")
     ips = [cfg['machines']['server']] + cfg['machines']['clients']
     agenda.task(f"connecting to {ips}")
-    machines, commits = zip(*[check_machine(ip) for ip in ips])
+    machines, commits = zip(*in_parallel(check_machine, ips))
     # check all the commits are equal
     if not all(c == commits[0] for c in commits):
         agenda.subfailure(f"not all commits equal: {commits}")
         raise Exception("Commits mismatched on machines")
     return machines
 
-def setup_all(machines, cfg, args, setup_fn, compile_fn):
+def setup_all(machines, cfg, args, setup_fn, compile_fn=None):
     global thread_ok
     thread_ok = True
 
@@ -987,31 +1474,27 @@ def setup_all(machines, cfg, args, setup_fn, compile_fn):
         target_dir = f"/proj/{res.stdout.strip().split()[0]}"
 
     fn_args = (args.outdir, cfg['exp']['datapath'] if 'datapath' in cfg['exp'] else [], args.dpdk_driver, target_dir)
-    agenda.task("setup machines")
-
-    setups = [threading.Thread(target=setup_fn, args=(m, *fn_args)) for m in machines]
-    [t.start() for t in setups]
-    [t.join() for t in setups]
+    intel_dpdk = 'intel' == args.dpdk_driver and 'datapath' in cfg['exp'] and any('dpdk' in d for d in cfg['exp']['datapath'])
+
+    # each machine goes setup -> nic driver -> build on its own, so a machine that finishes
+    # setup early starts building instead of waiting for the slowest machine's setup.
+    # on cloudlab, machines[0] builds into the shared /proj target dir for everyone.
+    def setup_one(m):
+        setup_fn(m, *fn_args)
+        if intel_dpdk:
+            agenda.subtask(f"[{m.addr}] setup intel-driver machine for DPDK")
+            intel_setup_one(m)
+        if 'mlx' in args.dpdk_driver:
+            mlx_ofed_install_one(m)
+        if compile_fn is not None and (not args.cloudlab or m is machines[0]):
+            agenda.subtask(f"[{m.addr}] build binaries")
+            compile_fn(m, *fn_args)
+
+    agenda.task("setup machines and build binaries")
+    in_parallel(setup_one, machines)
     if not thread_ok:
         agenda.failure("Something went wrong")
         raise Exception("setup error")
-
-    if 'intel' == args.dpdk_driver and 'datapath' in cfg['exp'] and any('dpdk' in d for d in cfg['exp']['datapath']):
-        intel_setup(machines)
-
-    if 'mlx' in args.dpdk_driver:
-        mlx_ofed_install(machines)
-
-    agenda.task("build binaries")
-    if args.cloudlab:
-        compile_fn(machines[0], *fn_args)
-    else:
-        setups = [threading.Thread(target=compile_fn, args=(m, *fn_args)) for m in machines]
-        [t.start() for t in setups]
-        [t.join() for t in setups]
-        if not thread_ok:
-            agenda.failure("Something went wrong")
-            raise Exception("setup error")
     agenda.task("done building")
 
     ms = ([cfg['machines']['server']] if not type(cfg['machines']['server']) == list else cfg['machines']['server']) + cfg['machines']['clients']
@@ -1030,20 +1513,19 @@ def setup_all(machines, cfg, args, setup_fn, compile_fn):
         intel_devbind(machines, 'kernel')
 
     if any('shenango' in d or 'dpdk' in d for d in cfg['exp']['datapath']):
-        for m in machines:
-            pci_addr = get_pci_addr(m)
+        for (m, pci_addr) in zip(machines, in_parallel(get_pci_addr, machines)):
             m.pci_addr = pci_addr
 
     agenda.task("writing configuration files")
     if any('shenango' in d for d in cfg['exp']['datapath']):
-        for m in machines:
-            lcores = cfg['cfg']['lcores'].split(',')
-            agenda.subtask(f"shenango config num_threads={lcores}")
-            #write_shenango_config(m, max(len(lcores)-1, 2))
-            write_shenango_config(m, 8)
+        lcores = cfg['cfg']['lcores'].split(',')
+        agenda.subtask(f"shenango config num_threads={lcores}")
+        #write_shenango_config(m, max(len(lcores)-1, 2))
+        in_parallel(lambda m: write_shenango_config(m, 8), machines)
     if any('dpdk' in d for d in cfg['exp']['datapath']):
-        for m in machines:
-            write_dpdk_config(m, machines, cfg['cfg']['lcores'])
+        # every machine's config lists every machine's pci address, so this comes after
+        # all of them are known
+        in_parallel(lambda m: write_dpdk_config(m, machines, cfg['cfg']['lcores']), machines)
 
 ### Sample config
 ### [machines]
@@ -1139,46 +1621,64 @@ if __name__ == '__main__':
             m.is_local = False
 
     if not found_local:
-        subprocess.run(f"mkdir -p {args.outdir}", shell=True)
+        os.makedirs(args.outdir, exist_ok=True)
 
     # build
     setup_all(machines, cfg, args, setup_machine, compile_binaries)
 
-    for w in cfg['exp']['wrk']:
-        for conn in machines:
-            ok = conn.run(f"ls {w}")
-            if ok.exited != 0:
-                generate_ycsb_file(conn, w)
+    in_parallel(lambda conn: ensure_ycsb_files(conn, cfg['exp']['wrk']), machines)
 
     if args.setup_only:
         agenda.task("setup done")
         sys.exit(0)
 
-    for dp in cfg['exp']['datapath']:
-        if 'intel' == args.dpdk_driver:
-            intel_devbind(machines, dp)
-
-        for noch in cfg['exp']['no-chunnels']:
-            for neg in cfg['exp']['negotiation']:
-                for w in cfg['exp']['wrk']:
-                    for s in cfg['exp']['shards']:
-                        for t in cfg['exp']['shardtype']:
-                            for p in cfg['exp']['poisson-arrivals']:
-                                for o in ops_per_sec:
-                                    do_exp(0,
-                                        outdir=outdir,
-                                        machines=machines,
-                                        num_shards=s,
-                                        shardtype=t,
-                                        ops_per_sec=o,
-                                        datapath=dp,
-                                        poisson_arrivals=p,
-                                        skip_negotiation=not neg,
-                                        wrkload=w,
-                                        overwrite=args.overwrite,
-                                        cfg_client=cfg['cfg']['client'],
-                                        no_chunnels=noch,
-                                        cloudlab=args.cloudlab,
-                                    )
+    # enumerate the whole grid first, so experiments that already have results are pruned
+    # before paying for any setup. axes are listed outermost first; the server_params come
+    # first, so experiments that can share a server are adjacent in the product.
+    axes = {
+        'datapath': cfg['exp']['datapath'],
+        'no_chunnels': cfg['exp']['no-chunnels'],
+        'skip_negotiation': [not neg for neg in cfg['exp']['negotiation']],
+        'wrkload': cfg['exp']['wrk'],
+        'num_shards': cfg['exp']['shards'],
+        'shardtype': cfg['exp']['shardtype'],
+        'poisson_arrivals': cfg['exp']['poisson-arrivals'],
+        'ops_per_sec': ops_per_sec,
+    }
+    assert set(list(axes)[:len(server_params)]) == set(server_params)
+    exps = [dict(zip(axes, combo)) for combo in itertools.product(*axes.values())]
+    num_exps = len(exps)
+    exps = [e for e in exps if no_chunnels_supported(e['no_chunnels'], e['datapath'], e['shardtype'])]
+    if len(exps) < num_exps:
+        agenda.task(f"skipping {num_exps - len(exps)} experiments: no_chunnels mode supported only for dpdkmulti + client sharding")
+    if not args.overwrite:
+        exps = [e for e in exps if not os.path.exists(exp_done_file(outdir, machines, 0, **e))]
+    agenda.task(f"{len(exps)} of {num_exps} experiments to run")
+
+    redis_addr = None
+    if any(not e['no_chunnels'] for e in exps):
+        redis_addr = start_redis(machines[0])
+
+    # start one server per server configuration, and run each of its experiments' clients
+    # against it
+    exp_args = dict(outdir=outdir, machines=machines, cloudlab=args.cloudlab)
+    curr_dp = None
+    for srv_key, group in itertools.groupby(exps, key=lambda e: tuple(e[k] for k in server_params)):
+        srv = dict(zip(server_params, srv_key))
+        if srv['datapath'] != curr_dp and 'intel' == args.dpdk_driver:
+            intel_devbind(machines, srv['datapath'])
+        curr_dp = srv['datapath']
+
+        start_experiment_server(0, cfg_client=cfg['cfg']['client'], redis_addr=redis_addr, **exp_args, **srv)
+        try:
+            for e in group:
+                # a server that crashed partway through the group would fail every remaining experiment
+                if not wait_proc(machines[0], "kvserver", timeout=0):
+                    agenda.subfailure(f"kvserver on {machines[0].addr} exited, restarting it")
+                    stop_experiment_server(0, **exp_args, **srv)
+                    start_experiment_server(0, cfg_client=cfg['cfg']['client'], redis_addr=redis_addr, **exp_args, **srv)
+                run_experiment_clients(0, cfg_client=cfg['cfg']['client'], redis_addr=redis_addr, **exp_args, **e)
+        finally:
+            stop_experiment_server(0, **exp_args, **srv)
 
     agenda.task("done")
@@ -1,6 +1,6 @@
 #!/usr/bin/python3
 
-from kv import ConnectionWrapper, check_machine, get_local, check, get_timeout_local, write_dpdk_config, write_cfg
+from kv import ConnectionWrapper, check_machine, get_local, check, get_timeout_local, write_dpdk_config, write_cfg, in_parallel, build_stamp
 import agenda
 import argparse
 import os
@@ -25,7 +25,7 @@ def setup_machine(conn, outdir):
     ok = conn.run(f"mkdir -p ~/burrito/{outdir}")
     check(ok, "mk outdir", conn.addr)
     agenda.subtask(f"building burrito on {conn.addr}")
-    ok = conn.run("../../.cargo/bin/cargo b --release", wd = "~/burrito/latency-bench")
+    ok = conn.run_builds(["cd latency-bench && ~/.cargo/bin/cargo b --release"], build_stamp(None, "latency-bench"))
     check(ok, "build", conn.addr)
     return conn
 
@@ -222,7 +222,7 @@ if __name__ == '__main__':
     agenda.task(f"Checking for connection vs experiment ip")
     ips = [cfg['machines']['server']] + cfg['machines']['clients']
     agenda.task(f"connecting to {ips}")
-    machines, commits = zip(*[check_machine(ip) for ip in ips])
+    machines, commits = zip(*in_parallel(check_machine, ips))
     # check all the commits are equal
     if not all(c == commits[0] for c in commits):
         agenda.subfailure(f"not all commits equal: {commits}")
@@ -1,4 +1,5 @@
 import ipaddress
+import shlex
 import subprocess
 import agenda
 import sys
@@ -33,7 +34,7 @@ class LocalCn:
     """
     def run(self, cmd, *args, stdin=None, stdout=None, stderr=None, ignore_out=False, wd=None, sudo=False, background=False, quiet=False, **kwargs):
         if sudo:
-            cmd = f"sudo bash -c {cmd}"
+            cmd = f"sudo bash -c {shlex.quote(cmd)}"
         if not quiet:
             agenda.subtask("[{}]{} {}".format('local', " (bg) " if background else "      ", cmd))
         if ignore_out:
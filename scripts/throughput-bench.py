@@ -1,7 +1,6 @@
 #!/usr/bin/python3
 
-from kv import get_local, check, connect_machines, setup_all, intel_devbind
-import subprocess
+from kv import get_local, check, connect_machines, setup_all, intel_devbind, build_stamp
 import agenda
 import argparse
 import os
@@ -101,6 +100,7 @@ def run_client(conn, server, num_clients, file_size, packet_size, variant, use_b
         stdout=f"{outf}.out",
         stderr=f"{outf}.err",
         timeout=180,
+        pty=True,
         )
     try:
         check(ok, "throughput-bench", conn.addr)
@@ -283,7 +283,7 @@ def setup_machine(conn, outdir, datapaths, dpdk_driver):
                     needed_features.append('use_shenango')
 
         agenda.subtask(f"building throughput-bench features={needed_features}")
-        ok = conn.run(f"~/.cargo/bin/cargo +nightly build --release --features=\"{','.join(needed_features)}\"", wd = "~/burrito/throughput-bench")
+        ok = conn.run_builds([f"cd throughput-bench && ~/.cargo/bin/cargo +nightly build --release --features=\"{','.join(needed_features)}\""], build_stamp(None, "throughput-bench"))
         check(ok, "throughput-bench build", conn.addr)
         return conn
     except Exception as e:
@@ -372,7 +372,7 @@ if __name__ == '__main__':
             m.is_local = False
 
     if not found_local:
-        subprocess.run(f"mkdir -p {args.outdir}", shell=True)
+        os.makedirs(args.outdir, exist_ok=True)
 
     if True in cfg['exp']['tcp']:
         needs_tcp_feature = True